@@ -5,7 +5,7 @@
 
 from sqlalchemy import (
     create_engine, MetaData, Table, Column,
-    Integer, String, Date, ForeignKey, text
+    Integer, String, Date, ForeignKey, UniqueConstraint, Index, text
 )
 
 # 1) Update this URL with your Postgres credentials / host / port / database
@@ -25,21 +25,23 @@ metadata = MetaData(schema="star_schema")
 dim_user = Table(
     "dim_user", metadata,
     Column("user_key",    Integer, primary_key=True, autoincrement=True),
-    Column("user_id",     Integer, nullable=False, unique=True),
+    Column("user_id",     Integer, nullable=False),
     Column("first_name",  String(100)),
     Column("last_name",   String(100)),
     Column("email",       String(255)),
     Column("signup_date", Date),
 
     # ── ADDED: country column in dim_user ───────────────────────────────────────
-    Column("country",     String(100))                                              # ← ADDED
+    Column("country",     String(100)),                                             # ← ADDED
+
+    UniqueConstraint("user_id", name="dim_user_user_id_key"),
 )
 
 # 5) Dimension: Courses
 dim_course = Table(
     "dim_course", metadata,
     Column("course_key",       Integer, primary_key=True, autoincrement=True),
-    Column("course_id",        Integer, nullable=False, unique=True),
+    Column("course_id",        Integer, nullable=False),
     Column("title",            String(255)),
     Column("subject",          String(100)),
     Column("price_in_rubbles", Integer),
@@ -47,51 +49,59 @@ dim_course = Table(
     # These two were already present:
     Column("category",         String(100)),
     Column("sub_category",     String(100)),
+
+    UniqueConstraint("course_id", name="dim_course_course_id_key"),
 )
 
 # 6) Dimension: Traffic Sources
 dim_traffic_source = Table(
     "dim_traffic_source", metadata,
     Column("traffic_source_key", Integer, primary_key=True, autoincrement=True),
-    Column("traffic_source_id",  Integer, nullable=False, unique=True),
+    Column("traffic_source_id",  Integer, nullable=False),
     Column("name",               String(100)),
     Column("channel",            String(100)),
+
+    UniqueConstraint("traffic_source_id", name="dim_traffic_source_traffic_source_id_key"),
 )
 
 # 7) Dimension: Sales Managers  ← NEW
 dim_sales_manager = Table(
     "dim_sales_manager", metadata,
     Column("sales_manager_key", Integer, primary_key=True, autoincrement=True),
-    Column("manager_id",        Integer, nullable=False, unique=True),
+    Column("manager_id",        Integer, nullable=False),
     Column("first_name",        String(100)),
     Column("last_name",         String(100)),
     Column("email",             String(255)),
     Column("hired_at",          Date),
+
+    UniqueConstraint("manager_id", name="dim_sales_manager_manager_id_key"),
 )
 
 # 8) Dimension: Date
 dim_date = Table(
     "dim_date", metadata,
     Column("date_key", Integer, primary_key=True, autoincrement=True),
-    Column("date",     Date,    nullable=False, unique=True),
+    Column("date",     Date,    nullable=False),
     Column("year",     Integer),
     Column("quarter",  Integer),
     Column("month",    Integer),
     Column("day",      Integer),
     Column("weekday",  Integer),
+
+    UniqueConstraint("date", name="dim_date_date_key"),
 )
 
 # 9) Fact: Sales
 fact_sales = Table(
     "fact_sales", metadata,
     Column("sale_key",           Integer, primary_key=True, autoincrement=True),
-    Column("sale_id",            Integer, nullable=False, unique=True),
+    Column("sale_id",            Integer, nullable=False),
 
     # FK → dim_user
     Column(
         "user_key",
         Integer,
-        ForeignKey("star_schema.dim_user.user_key", ondelete="RESTRICT"),
+        ForeignKey("star_schema.dim_user.user_key", ondelete="RESTRICT", name="fact_sales_user_key_fkey"),
         nullable=False
     ),
 
@@ -99,7 +109,7 @@ fact_sales = Table(
     Column(
         "course_key",
         Integer,
-        ForeignKey("star_schema.dim_course.course_key", ondelete="RESTRICT"),
+        ForeignKey("star_schema.dim_course.course_key", ondelete="RESTRICT", name="fact_sales_course_key_fkey"),
         nullable=False
     ),
 
@@ -107,7 +117,7 @@ fact_sales = Table(
     Column(
         "sales_manager_key",
         Integer,
-        ForeignKey("star_schema.dim_sales_manager.sales_manager_key", ondelete="RESTRICT"),
+        ForeignKey("star_schema.dim_sales_manager.sales_manager_key", ondelete="RESTRICT", name="fact_sales_sales_manager_key_fkey"),
         nullable=False
     ),
 
@@ -115,7 +125,7 @@ fact_sales = Table(
     Column(
         "traffic_source_key",
         Integer,
-        ForeignKey("star_schema.dim_traffic_source.traffic_source_key", ondelete="RESTRICT"),
+        ForeignKey("star_schema.dim_traffic_source.traffic_source_key", ondelete="RESTRICT", name="fact_sales_traffic_source_key_fkey"),
         nullable=False
     ),
 
@@ -123,15 +133,50 @@ fact_sales = Table(
     Column(
         "date_key",
         Integer,
-        ForeignKey("star_schema.dim_date.date_key", ondelete="RESTRICT"),
+        ForeignKey("star_schema.dim_date.date_key", ondelete="RESTRICT", name="fact_sales_date_key_fkey"),
         nullable=False
     ),
 
     Column("total_in_rubbles", Integer),
     Column("enrollment_count",  Integer, nullable=False, server_default=text("1")),
+
+    UniqueConstraint("sale_id", name="fact_sales_sale_id_key"),
+
+    # FK‐column indexes (the fact cleanup and dim DELETE RI checks probe these)
+    Index("ix_star_schema_fact_sales_user_key",           "user_key"),
+    Index("ix_star_schema_fact_sales_course_key",         "course_key"),
+    Index("ix_star_schema_fact_sales_sales_manager_key",  "sales_manager_key"),
+    Index("ix_star_schema_fact_sales_traffic_source_key", "traffic_source_key"),
 )
 
-# 10) Execute CREATE TABLE for all DDL above
+# 10) Daily aggregate of fact_sales at the (date, course, manager, traffic source) grain.
+#     Created WITH NO DATA; elt.py refreshes it after every load. The unique index is what
+#     REFRESH MATERIALIZED VIEW CONCURRENTLY requires.
+FACT_SALES_DAILY_DDL = [
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS star_schema.fact_sales_daily AS
+    SELECT
+      date_key,
+      course_key,
+      sales_manager_key,
+      traffic_source_key,
+      SUM(total_in_rubbles)  AS total_in_rubbles,
+      SUM(enrollment_count)  AS enrollment_count,
+      COUNT(*)               AS sale_count
+    FROM star_schema.fact_sales
+    GROUP BY date_key, course_key, sales_manager_key, traffic_source_key
+    WITH NO DATA
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_fact_sales_daily
+        ON star_schema.fact_sales_daily (date_key, course_key, sales_manager_key, traffic_source_key)
+    """,
+]
+
+# 11) Execute CREATE TABLE for all DDL above
 if __name__ == "__main__":
     metadata.create_all(engine)
-    print("✅ Star schema tables created (including dim_sales_manager).")
+    with engine.begin() as conn:
+        for ddl in FACT_SALES_DAILY_DDL:
+            conn.execute(text(ddl))
+    print("✅ Star schema tables created (including dim_sales_manager and fact_sales_daily).")
@@ -10,10 +10,15 @@ from sqlalchemy import (
     String,
     Text,
     DateTime,
+    Date,
+    Computed,
     ForeignKey,
     CheckConstraint,
+    Index,
     text
 )
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
 import datetime
 
 # ───────────── 1) DATABASE URL ─────────────────────────────────────────────────
@@ -50,6 +55,17 @@ warehouse_users = Table(
     Column("source_id",    Integer,  nullable=False),
     Column("insert_id",    Integer,  nullable=False),
     Column("update_id",    Integer,  nullable=True),
+
+    # ── Active‐slice lookup index (end_date = '9999-12-31') ─────────────────────
+    Index(
+        "ix_users_active", "user_id",
+        postgresql_where=text("end_date = '9999-12-31'::DATE"),
+        postgresql_include=["user_sk", "first_name", "last_name", "email", "phone", "country", "registered_at"],
+    ),
+
+    # ── Batch lookups (star‐schema refresh: insert_id / update_id = :batch) ──────
+    Index("ix_users_insert_id", "insert_id"),
+    Index("ix_users_update_id", "update_id"),
 )
 
 # 4.2) sales_managers table in warehouse
@@ -68,6 +84,17 @@ warehouse_sales_managers = Table(
     Column("source_id",    Integer,  nullable=False),
     Column("insert_id",    Integer,  nullable=False),
     Column("update_id",    Integer,  nullable=True),
+
+    # ── Active‐slice lookup index (end_date = '9999-12-31') ─────────────────────
+    Index(
+        "ix_sales_managers_active", "manager_id",
+        postgresql_where=text("end_date = '9999-12-31'::DATE"),
+        postgresql_include=["sales_manager_sk", "first_name", "last_name", "email", "hired_at"],
+    ),
+
+    # ── Batch lookups (star‐schema refresh: insert_id / update_id = :batch) ──────
+    Index("ix_sales_managers_insert_id", "insert_id"),
+    Index("ix_sales_managers_update_id", "update_id"),
 )
 
 # 4.3) courses table in warehouse
@@ -86,6 +113,7 @@ warehouse_courses = Table(
     # ── ADDED: category + sub_category columns ───────────────────────────────────
     Column("category",        String(100)),                                      # ← ADDED
     Column("sub_category",    String(100)),                                      # ← ADDED
+    Column("row_hash",        String(32)),      # md5 of the tracked attributes (see elt.COURSE_ROW_HASH_SQL)
 
     # ── Audit / SCD columns ────────────────────────────────────────────────────
     Column("start_date",   DateTime, nullable=False, server_default=text("NOW()")),
@@ -93,6 +121,17 @@ warehouse_courses = Table(
     Column("source_id",    Integer,  nullable=False),
     Column("insert_id",    Integer,  nullable=False),
     Column("update_id",    Integer,  nullable=True),
+
+    # ── Active‐slice lookup index (end_date = '9999-12-31') ─────────────────────
+    Index(
+        "ix_courses_active", "course_id",
+        postgresql_where=text("end_date = '9999-12-31'::DATE"),
+        postgresql_include=["course_sk", "row_hash"],
+    ),
+
+    # ── Batch lookups (star‐schema refresh: insert_id / update_id = :batch) ──────
+    Index("ix_courses_insert_id", "insert_id"),
+    Index("ix_courses_update_id", "update_id"),
 )
 
 # 4.4) enrollments table in warehouse
@@ -116,6 +155,17 @@ warehouse_enrollments = Table(
     Column("source_id",    Integer,  nullable=False),
     Column("insert_id",    Integer,  nullable=False),
     Column("update_id",    Integer,  nullable=True),
+
+    # ── Active‐slice lookup index (end_date = '9999-12-31') ─────────────────────
+    Index(
+        "ix_enrollments_active", "enrollment_id",
+        postgresql_where=text("end_date = '9999-12-31'::DATE"),
+        postgresql_include=["enrollment_sk", "user_sk", "course_sk", "enrolled_at", "status"],
+    ),
+
+    # ── Batch lookups (star‐schema refresh: insert_id / update_id = :batch) ──────
+    Index("ix_enrollments_insert_id", "insert_id"),
+    Index("ix_enrollments_update_id", "update_id"),
 )
 
 # 4.5) sales table in warehouse
@@ -126,6 +176,7 @@ warehouse_sales = Table(
     Column("enrollment_sk",   Integer, ForeignKey("warehouse.enrollments.enrollment_sk"), nullable=False),
     Column("sales_manager_sk",Integer, ForeignKey("warehouse.sales_managers.sales_manager_sk"), nullable=False),
     Column("sale_date",       DateTime, nullable=False, default=datetime.datetime.utcnow),
+    Column("sale_date_d",     Date, Computed("sale_date::DATE", persisted=True)),   # dim_date join key
     Column("cost_in_rubbles", Integer,  nullable=False),
 
     CheckConstraint("cost_in_rubbles >= 0", name="cost_in_rubbles_non_negative"),
@@ -136,6 +187,17 @@ warehouse_sales = Table(
     Column("source_id",    Integer,  nullable=False),
     Column("insert_id",    Integer,  nullable=False),
     Column("update_id",    Integer,  nullable=True),
+
+    # ── Active‐slice lookup index (end_date = '9999-12-31') ─────────────────────
+    Index(
+        "ix_sales_active", "sale_id",
+        postgresql_where=text("end_date = '9999-12-31'::DATE"),
+        postgresql_include=["sale_sk", "enrollment_sk", "sales_manager_sk", "sale_date", "cost_in_rubbles"],
+    ),
+
+    # ── Batch lookups (star‐schema refresh: insert_id / update_id = :batch) ──────
+    Index("ix_sales_insert_id", "insert_id"),
+    Index("ix_sales_update_id", "update_id"),
 )
 
 # 4.6) traffic_sources table in warehouse
@@ -146,6 +208,7 @@ warehouse_traffic_sources = Table(
     Column("name",            String(100), nullable=False),
     Column("channel",         String(100), nullable=False),
     Column("details",         Text),
+    Column("row_hash",        String(32)),      # md5 of the tracked attributes (see elt.TRAFFIC_SOURCE_ROW_HASH_SQL)
 
     # ── Audit / SCD columns ────────────────────────────────────────────────────
     Column("start_date",       DateTime, nullable=False, server_default=text("NOW()")),
@@ -153,6 +216,17 @@ warehouse_traffic_sources = Table(
     Column("source_id_audit",  Integer, nullable=False),
     Column("insert_id",        Integer, nullable=False),
     Column("update_id",        Integer, nullable=True),
+
+    # ── Active‐slice lookup index (end_date = '9999-12-31') ─────────────────────
+    Index(
+        "ix_traffic_sources_active", "source_id",
+        postgresql_where=text("end_date = '9999-12-31'::DATE"),
+        postgresql_include=["traffic_source_sk", "name", "channel", "row_hash"],
+    ),
+
+    # ── Batch lookups (star‐schema refresh: insert_id / update_id = :batch) ──────
+    Index("ix_traffic_sources_insert_id", "insert_id"),
+    Index("ix_traffic_sources_update_id", "update_id"),
 )
 
 # 4.7) user_traffic table in warehouse
@@ -170,9 +244,87 @@ warehouse_user_traffic = Table(
     Column("source_id_audit",  Integer, nullable=False),
     Column("insert_id",        Integer, nullable=False),
     Column("update_id",        Integer, nullable=True),
+
+    # ── Active‐slice lookup index (end_date = '9999-12-31') ─────────────────────
+    Index(
+        "ix_user_traffic_active", "user_sk", "traffic_source_sk", "referred_at",
+        postgresql_where=text("end_date = '9999-12-31'::DATE"),
+        postgresql_include=["user_traffic_sk", "campaign_code"],
+    ),
+
+    # ── Batch lookups (star‐schema refresh: insert_id / update_id = :batch) ──────
+    Index("ix_user_traffic_insert_id", "insert_id"),
+    Index("ix_user_traffic_update_id", "update_id"),
 )
 
+# Latest active referral per user, read in order by the fact_sales build
+# (DISTINCT ON (user_sk) … ORDER BY user_sk, referred_at DESC)
+Index(
+    "ix_user_traffic_latest",
+    warehouse_user_traffic.c.user_sk,
+    warehouse_user_traffic.c.referred_at.desc(),
+    postgresql_where=text("end_date = '9999-12-31'::DATE"),
+    postgresql_include=["traffic_source_sk"],
+)
+
+# Unbounded TEXT columns copied into every SCD2 version: LZ4 (PG14+) compresses and
+# decompresses TOASTed values several times faster than the default pglz
+LZ4_COLUMNS = [
+    ("courses",         "description"),
+    ("traffic_sources", "details"),
+]
+
+# create_all() skips tables that already exist, so columns added to existing tables are
+# brought in here (idempotent). row_hash is backfilled for the active rows; otherwise the first
+# incremental run would see a NULL hash and re‐version every one of them. The hash expressions
+# must stay identical to elt.COURSE_ROW_HASH_SQL / elt.TRAFFIC_SOURCE_ROW_HASH_SQL.
+MIGRATIONS = [
+    "ALTER TABLE warehouse.sales ADD COLUMN IF NOT EXISTS sale_date_d DATE "
+    "GENERATED ALWAYS AS (sale_date::DATE) STORED",
+    "ALTER TABLE warehouse.courses ADD COLUMN IF NOT EXISTS row_hash VARCHAR(32)",
+    "ALTER TABLE warehouse.traffic_sources ADD COLUMN IF NOT EXISTS row_hash VARCHAR(32)",
+    """
+    UPDATE warehouse.courses AS c
+       SET row_hash = md5(ROW(c.title, c.subject, c.description, c.price_in_rubbles,
+                              EXTRACT(EPOCH FROM c.created_at), c.category, c.sub_category)::text)
+     WHERE c.row_hash IS NULL
+       AND c.end_date = '9999-12-31'::DATE
+    """,
+    """
+    UPDATE warehouse.traffic_sources AS t
+       SET row_hash = md5(ROW(t.name, t.channel, t.details)::text)
+     WHERE t.row_hash IS NULL
+       AND t.end_date = '9999-12-31'::DATE
+    """,
+]
+
+# create_all() also skips the indexes of existing tables: every index declared above (active
+# slice, insert_id / update_id batch lookups, latest referral) is (re)issued with
+# CREATE INDEX IF NOT EXISTS so older warehouses get them too
+TABLE_INDEXES = [
+    index
+    for table in metadata.sorted_tables
+    for index in table.indexes
+]
+
 # ───────────── 5) CREATE ALL TABLES AT ONCE ─────────────────────────────────────
 if __name__ == "__main__":
     metadata.create_all(engine)
+    with engine.begin() as conn:
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
+        for index in TABLE_INDEXES:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+    # LZ4 is optional: in its own transaction after the migrations have committed, and only on
+    # PG14+ servers built with lz4; anything else keeps the default pglz
+    try:
+        with engine.begin() as conn:
+            if int(conn.execute(text("SHOW server_version_num")).scalar()) >= 140000:
+                for table, column in LZ4_COLUMNS:
+                    conn.execute(text(f"ALTER TABLE warehouse.{table} ALTER COLUMN {column} SET COMPRESSION lz4"))
+            else:
+                print("ℹ️  PostgreSQL < 14: keeping default TOAST compression")
+    except DBAPIError as exc:
+        print(f"ℹ️  LZ4 compression not available, keeping default TOAST compression ({exc.orig})")
     print("✅ All warehouse tables created (including sales_managers, surrogate PKs, and corrected FKs).")
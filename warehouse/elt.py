@@ -14,16 +14,18 @@ This script performs a Slowly Changing Dimension (SCD2) load into a “warehouse
 then builds a star‐schema (dim_user, dim_course, dim_traffic_source, dim_sales_manager, dim_date, fact_sales).
 
 **Key change for incremental:**
-During INCREMENTAL loads, we now rebuild the entire `fact_sales` from all **active** (`update_id IS NULL`, `end_date = '9999-12-31'`) rows in `warehouse.sales`.
+During INCREMENTAL loads, `fact_sales` is refreshed as a delta: rows invalidated by the batch (re‐versioned sales, closed dim keys,
+moved referrals) are deleted, then every **active** (`update_id IS NULL`, `end_date = '9999-12-31'`) row in `warehouse.sales`
+that has no fact row is inserted.
 This ensures that _every_ current version (where `update_id IS NULL`) ends up in the star schema, not just those inserted in the current batch.
 
 **NEW**: We also want to load **`data_sources/user_traffic.csv`** into `warehouse.user_traffic`
 (with `source_id_audit = 2`), using exactly the same SCD2 logic that we already use for `source.user_traffic` (“source” side is `source_id_audit = 1`).
 That means:
   1. On a **full load**, insert all CSV rows (as if they were “brand‐new”) with `source_id_audit = 2`.
-  2. On an **incremental load**, do two sub‐steps:
+  2. On an **incremental load**, in one set‐based statement:
      - Insert any CSV row that did not exist at all in `warehouse.user_traffic` (matching on keys `(user_sk, traffic_source_sk, referred_at)`).
-     - For those that _did_ exist but whose `campaign_code` changed, “close out” the old version (set its `end_date = NOW()` and `update_id = batch`) and insert a new version with `source_id_audit = 2`.
+     - For those that _did_ exist but whose `campaign_code` changed, “close out” the old version (set its `end_date = now_ts` and `update_id = batch`) and insert a new version with `source_id_audit = 2`.
 
 **Important**: _Don’t_ change **any** of the existing SCD2 logic against `source.user_traffic`; we merely tack on a second pass that picks up CSV‐side rows and treats them in parallel (just using `source_id_audit = 2`).
 """
@@ -32,6 +34,7 @@ import sys
 import datetime
 import pytz
 import csv
+import io
 from sqlalchemy import create_engine, text
 
 # ───────────── Configuration ───────────────────────────────────────────────────
@@ -42,112 +45,248 @@ SRC_CSV_AUDIT_ID = 2   # arbitrary source_id for CSV‐based audit
 # Adjust this path if your CSV lives somewhere else:
 CSV_PATH = "data_sources/user_traffic.csv"
 
+# Fingerprint of the tracked warehouse.courses attributes, stored as courses.row_hash so
+# change detection compares one fixed‐width value instead of seven columns (incl. TOASTed text).
+# created_at goes in as epoch seconds so the hash does not depend on the session's DateStyle.
+# create_warehouse.db.py backfills row_hash with the same expressions: keep both in sync.
+COURSE_ROW_HASH_SQL = (
+    "md5(ROW({c}.title, {c}.subject, {c}.description, {c}.price_in_rubbles, "
+    "EXTRACT(EPOCH FROM {c}.created_at), {category}, {sub_category})::text)"
+)
+
+# Same for warehouse.traffic_sources: details is unbounded TEXT, so compare its fingerprint
+TRAFFIC_SOURCE_ROW_HASH_SQL = "md5(ROW({t}.name, {t}.channel, {t}.details)::text)"
+
 # ───────────── Engines ───────────────────────────────────────────────────────────
-source_engine    = create_engine(DB_URL, echo=False)
+# Source and warehouse schemas live in the same database, so a single engine serves both. Each
+# load holds one connection at a time, so the default pool size is enough.
 warehouse_engine = create_engine(DB_URL, echo=False)
 
 
+def tune_bulk_transaction(conn):
+    """
+    Relax durability and raise memory limits for the current transaction only (SET LOCAL).
+    Losing the last commits on a crash is acceptable here: every load step is re‐runnable,
+    and without the WAL fsync wait bulk INSERTs run several times faster.
+    Also allow more parallel workers for what PostgreSQL can parallelize in a load: the
+    index builds behind re‐added constraints, REFRESH MATERIALIZED VIEW and plain reads.
+    """
+    conn.execute(text("SET LOCAL synchronous_commit = OFF"))
+    conn.execute(text("SET LOCAL work_mem = '512MB'"))
+    conn.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+    conn.execute(text("SET LOCAL max_parallel_workers_per_gather = 4"))
+    conn.execute(text("SET LOCAL max_parallel_maintenance_workers = 4"))
+
+
+def stage_user_traffic_csv(conn):
+    """
+    COPY the CSV file into staging.user_traffic_csv, creating the table on first use.
+    The staging table is UNLOGGED (no WAL) and truncated on every call, since its rows
+    are rebuilt from the CSV on each run anyway.
+    Expects the CSV columns to be exactly: user_id, source_id, referred_at (ISO‐timestamp), campaign_code
+    The file is streamed to the server as raw bytes; Postgres does the decoding and parsing.
+    """
+    conn.execute(text("CREATE SCHEMA IF NOT EXISTS staging"))
+    conn.execute(text("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS staging.user_traffic_csv (
+            user_id       INTEGER,
+            source_id     INTEGER,
+            referred_at   TIMESTAMP,
+            campaign_code TEXT
+        );
+    """))
+    conn.execute(text("TRUNCATE TABLE staging.user_traffic_csv"))
+
+    with conn.connection.cursor() as cur, open(CSV_PATH, "rb") as f:
+        cur.copy_expert(
+            "COPY staging.user_traffic_csv (user_id, source_id, referred_at, campaign_code) "
+            "FROM STDIN WITH (FORMAT csv, HEADER true)",
+            f,
+        )
+
+
+def closed_keys(conn, table, sk_column, batch_id):
+    """
+    Surrogate keys of the warehouse.<table> versions this batch closed (update_id = batch_id).
+    Fetched once per star refresh and passed back as array parameters, so the dim/fact DELETEs
+    probe a constant key list instead of re‐running the subquery, and are skipped when empty.
+    """
+    rows = conn.execute(
+        text(f"SELECT {sk_column} FROM warehouse.{table} WHERE update_id = :batch"),
+        {"batch": batch_id},
+    )
+    return [r[0] for r in rows]
+
+
+def copy_dim_date(conn, first_day, last_day):
+    """
+    COPY one star_schema.dim_date row per day in [first_day, last_day].
+    Calendar parts are computed here in Python; weekday follows PostgreSQL's DOW (Sunday = 0).
+    Returns the number of days written.
+    """
+    total_days = (last_day - first_day).days + 1
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for i in range(total_days):
+        d = first_day + datetime.timedelta(days=i)
+        writer.writerow((
+            int(d.strftime("%Y%m%d")),
+            d.isoformat(),
+            d.year,
+            (d.month - 1) // 3 + 1,
+            d.month,
+            d.day,
+            d.isoweekday() % 7,
+        ))
+    buf.seek(0)
+
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(
+            "COPY star_schema.dim_date (date_key, date, year, quarter, month, day, weekday) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buf,
+        )
+    return total_days
+
+
+def fact_sales_daily_state(conn):
+    """
+    None if star_schema.fact_sales_daily does not exist (a star schema created before the view
+    was added: re‐run create_star_schema.py), otherwise whether it has been populated.
+    """
+    return conn.execute(text("""
+        SELECT ispopulated
+        FROM pg_matviews
+        WHERE schemaname = 'star_schema' AND matviewname = 'fact_sales_daily';
+    """)).scalar()
+
+
+def star_schema_bulk_ddl(conn):
+    """
+    DROP/CREATE statement pairs for every FK, UNIQUE constraint and plain index on the
+    star_schema tables (primary keys stay), read from the catalog so names and definitions always
+    match what create_star_schema.py built. Ordered FKs → indexes → UNIQUEs: drop in this order,
+    re‐create in reverse, so each FK is validated against an existing key and every index is
+    built once in bulk instead of being maintained row by row.
+    """
+    rows = conn.execute(text("""
+        SELECT drop_sql, create_sql
+        FROM (
+            SELECT
+              CASE c.contype WHEN 'f' THEN 0 ELSE 2 END                        AS ord,
+              format('ALTER TABLE %s DROP CONSTRAINT %I', c.conrelid::regclass, c.conname) AS drop_sql,
+              format('ALTER TABLE %s ADD CONSTRAINT %I %s',
+                     c.conrelid::regclass, c.conname, pg_get_constraintdef(c.oid))       AS create_sql
+            FROM pg_constraint AS c
+            WHERE c.connamespace = 'star_schema'::regnamespace
+              AND c.contype IN ('f', 'u')
+            UNION ALL
+            SELECT
+              1,
+              format('DROP INDEX %s', i.indexrelid::regclass),
+              pg_get_indexdef(i.indexrelid)
+            FROM pg_index AS i
+            JOIN pg_class AS t
+              ON t.oid = i.indrelid
+             AND t.relkind = 'r'
+            WHERE t.relnamespace = 'star_schema'::regnamespace
+              AND NOT i.indisprimary
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint AS c WHERE c.conindid = i.indexrelid)
+        ) AS ddl
+        ORDER BY ord, drop_sql;
+    """))
+    return [(r.drop_sql, r.create_sql) for r in rows]
+
+
 def run_full_load():
     batch_id = 1
     now_ts = datetime.datetime.now(pytz.UTC)
     print(f"[{now_ts}] ▶️  Starting FULL load (batch_id={batch_id})\n")
 
-    # ─── 1) TRUNCATE all warehouse + star_schema tables in one short transaction ───
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("TRUNCATE TABLE warehouse.user_traffic        CASCADE"))
-        conn.execute(text("TRUNCATE TABLE warehouse.traffic_sources    CASCADE"))
-        conn.execute(text("TRUNCATE TABLE warehouse.sales             CASCADE"))
-        conn.execute(text("TRUNCATE TABLE warehouse.enrollments       CASCADE"))
-        conn.execute(text("TRUNCATE TABLE warehouse.courses           CASCADE"))
-        conn.execute(text("TRUNCATE TABLE warehouse.sales_managers    CASCADE"))
-        conn.execute(text("TRUNCATE TABLE warehouse.users             CASCADE"))
-
-        conn.execute(text("TRUNCATE TABLE star_schema.fact_sales         CASCADE"))
-        conn.execute(text("TRUNCATE TABLE star_schema.dim_date           CASCADE"))
-        conn.execute(text("TRUNCATE TABLE star_schema.dim_traffic_source CASCADE"))
-        conn.execute(text("TRUNCATE TABLE star_schema.dim_course         CASCADE"))
-        conn.execute(text("TRUNCATE TABLE star_schema.dim_user           CASCADE"))
-        conn.execute(text("TRUNCATE TABLE star_schema.dim_sales_manager  CASCADE"))
-    print("   • truncated all warehouse + star_schema tables\n")
-
-    # ───────────────────────────────────────────────────────────────────────────────
-    # 2) Populate each warehouse table in its own transaction (to release locks quickly)
-    # ───────────────────────────────────────────────────────────────────────────────
-    #
-    #  2.1) USERS → warehouse.users (SCD2 full)
+    # The whole full load is ONE transaction: a failure in any step rolls everything back instead
+    # of leaving a truncated or half‐built star schema behind, and readers (held off by the
+    # TRUNCATE locks) only ever see the complete new load. Status lines are printed after COMMIT.
+    report = []
     with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            INSERT INTO warehouse.users
-              (user_id, first_name, last_name, email, phone, country, registered_at,
-               start_date, end_date, source_id, insert_id, update_id)
-            SELECT
-              u.user_id,
-              u.first_name,
-              u.last_name,
-              u.email,
-              u.phone,
-              u.country,
-              u.registered_at,
-              NOW()               AS start_date,
-              '9999-12-31'::DATE  AS end_date,
-              :src_main           AS source_id,
-              :batch              AS insert_id,
-              NULL                AS update_id
-            FROM source.users AS u;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • loaded warehouse.users")
+        tune_bulk_transaction(conn)
 
-    #  2.2) SALES_MANAGERS → warehouse.sales_managers (SCD2 full)
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            INSERT INTO warehouse.sales_managers
-              (manager_id, first_name, last_name, email, hired_at,
-               start_date, end_date, source_id, insert_id, update_id)
-            SELECT
-              m.manager_id,
-              m.first_name,
-              m.last_name,
-              m.email,
-              m.hired_at,
-              NOW()               AS start_date,
-              '9999-12-31'::DATE  AS end_date,
-              :src_main           AS source_id,
-              :batch              AS insert_id,
-              NULL                AS update_id
-            FROM source.sales_managers AS m;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • loaded warehouse.sales_managers")
-
-    #  2.3) COURSES → warehouse.courses (SCD2 full)
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            INSERT INTO warehouse.courses
-              (course_id, title, subject, description, price_in_rubbles, created_at,
-               category, sub_category,
-               start_date, end_date, source_id, insert_id, update_id)
-            SELECT
-              c.course_id,
-              c.title,
-              c.subject,
-              c.description,
-              c.price_in_rubbles,
-              c.created_at,
-              cat.name                 AS category,
-              sub.name                 AS sub_category,
-              NOW()                    AS start_date,
-              '9999-12-31'::DATE       AS end_date,
-              :src_main                AS source_id,
-              :batch                   AS insert_id,
-              NULL                     AS update_id
-            FROM source.courses AS c
-            JOIN source.categories    AS cat ON c.category_id    = cat.category_id
-            JOIN source.subcategories AS sub ON c.subcategory_id = sub.subcategory_id;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • loaded warehouse.courses")
-
-    #  2.4) ENROLLMENTS → warehouse.enrollments (SCD2 full)
-    with warehouse_engine.begin() as conn:
+        # ─── 1) TRUNCATE all warehouse + star_schema tables ───
+        # One statement takes every lock at once; RESTART IDENTITY rewinds the surrogate‐key
+        # sequences so the reload hands out contiguous SKs again
         conn.execute(text("""
+            TRUNCATE TABLE
+                warehouse.user_traffic,
+                warehouse.traffic_sources,
+                warehouse.sales,
+                warehouse.enrollments,
+                warehouse.courses,
+                warehouse.sales_managers,
+                warehouse.users,
+                star_schema.fact_sales,
+                star_schema.dim_date,
+                star_schema.dim_traffic_source,
+                star_schema.dim_course,
+                star_schema.dim_user,
+                star_schema.dim_sales_manager
+            RESTART IDENTITY CASCADE;
+        """))
+        report.append("   • truncated all warehouse + star_schema tables\n")
+
+        # ───────────────────────────────────────────────────────────────────────────────
+        # 2) Populate every warehouse table
+        # ───────────────────────────────────────────────────────────────────────────────
+        #  2.1–2.4) USERS, COURSES → warehouse.users / warehouse.courses, and ENROLLMENTS resolved
+        #           against the RETURNING rows of those two inserts (one statement, no re‐scan of the
+        #           freshly loaded warehouse tables)
+        conn.execute(text(f"""
+            WITH users_ins AS (
+              --  2.1) USERS → warehouse.users (SCD2 full)
+              INSERT INTO warehouse.users
+                (user_id, first_name, last_name, email, phone, country, registered_at,
+                 start_date, end_date, source_id, insert_id, update_id)
+              SELECT
+                u.user_id,
+                u.first_name,
+                u.last_name,
+                u.email,
+                u.phone,
+                u.country,
+                u.registered_at,
+                :now_ts             AS start_date,
+                '9999-12-31'::DATE  AS end_date,
+                :src_main           AS source_id,
+                :batch              AS insert_id,
+                NULL                AS update_id
+              FROM source.users AS u
+              RETURNING user_sk, user_id
+            ),
+            courses_ins AS (
+              --  2.3) COURSES → warehouse.courses (SCD2 full)
+              INSERT INTO warehouse.courses
+                (course_id, title, subject, description, price_in_rubbles, created_at,
+                 category, sub_category, row_hash,
+                 start_date, end_date, source_id, insert_id, update_id)
+              SELECT
+                c.course_id,
+                c.title,
+                c.subject,
+                c.description,
+                c.price_in_rubbles,
+                c.created_at,
+                cat.name                 AS category,
+                sub.name                 AS sub_category,
+                {COURSE_ROW_HASH_SQL.format(c="c", category="cat.name", sub_category="sub.name")} AS row_hash,
+                :now_ts                  AS start_date,
+                '9999-12-31'::DATE       AS end_date,
+                :src_main                AS source_id,
+                :batch                   AS insert_id,
+                NULL                     AS update_id
+              FROM source.courses AS c
+              JOIN source.categories    AS cat ON c.category_id    = cat.category_id
+              JOIN source.subcategories AS sub ON c.subcategory_id = sub.subcategory_id
+              RETURNING course_sk, course_id
+            )
+            --  2.4) ENROLLMENTS → warehouse.enrollments (SCD2 full)
             INSERT INTO warehouse.enrollments
               (enrollment_id, user_sk, course_sk, enrolled_at, status,
                start_date, end_date, source_id, insert_id, update_id)
@@ -157,24 +296,42 @@ def run_full_load():
               c.course_sk,
               e.enrolled_at,
               e.status,
-              NOW()               AS start_date,
+              :now_ts             AS start_date,
               '9999-12-31'::DATE  AS end_date,
               :src_main           AS source_id,
               :batch              AS insert_id,
               NULL                AS update_id
             FROM source.enrollments AS e
-            JOIN warehouse.users AS u
-              ON e.user_id = u.user_id
-             AND u.end_date = '9999-12-31'::DATE
-            JOIN warehouse.courses AS c
-              ON e.course_id = c.course_id
-             AND c.end_date = '9999-12-31'::DATE;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • loaded warehouse.enrollments")
-
-    #  2.5) SALES → warehouse.sales (SCD2 full)
-    with warehouse_engine.begin() as conn:
+            JOIN users_ins   AS u ON e.user_id   = u.user_id
+            JOIN courses_ins AS c ON e.course_id = c.course_id;
+        """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+        report.append("   • loaded warehouse.users")
+        report.append("   • loaded warehouse.courses")
+        report.append("   • loaded warehouse.enrollments")
+
+        #  2.2+2.5) SALES_MANAGERS → warehouse.sales_managers, and SALES resolved against its
+        #           RETURNING rows plus the enrollments the statement above already wrote
         conn.execute(text("""
+            WITH managers_ins AS (
+              --  2.2) SALES_MANAGERS → warehouse.sales_managers (SCD2 full)
+              INSERT INTO warehouse.sales_managers
+                (manager_id, first_name, last_name, email, hired_at,
+                 start_date, end_date, source_id, insert_id, update_id)
+              SELECT
+                m.manager_id,
+                m.first_name,
+                m.last_name,
+                m.email,
+                m.hired_at,
+                :now_ts             AS start_date,
+                '9999-12-31'::DATE  AS end_date,
+                :src_main           AS source_id,
+                :batch              AS insert_id,
+                NULL                AS update_id
+              FROM source.sales_managers AS m
+              RETURNING sales_manager_sk, manager_id
+            )
+            --  2.5) SALES → warehouse.sales (SCD2 full)
             INSERT INTO warehouse.sales
               (sale_id, enrollment_sk, sales_manager_sk, sale_date, cost_in_rubbles,
                start_date, end_date, source_id, insert_id, update_id)
@@ -184,7 +341,7 @@ def run_full_load():
               m.sales_manager_sk,
               s.sale_date,
               s.cost_in_rubbles,
-              NOW()               AS start_date,
+              :now_ts             AS start_date,
               '9999-12-31'::DATE  AS end_date,
               :src_main           AS source_id,
               :batch              AS insert_id,
@@ -193,39 +350,71 @@ def run_full_load():
             JOIN warehouse.enrollments AS e
               ON s.enrollment_id = e.enrollment_id
              AND e.end_date = '9999-12-31'::DATE
-            JOIN warehouse.sales_managers AS m
-              ON s.manager_id = m.manager_id
-             AND m.end_date = '9999-12-31'::DATE;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • loaded warehouse.sales")
-
-    #  2.6) TRAFFIC_SOURCES → warehouse.traffic_sources (SCD2 full)
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            INSERT INTO warehouse.traffic_sources
-              (source_id, name, channel, details,
+            JOIN managers_ins AS m
+              ON s.manager_id = m.manager_id;
+        """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+        report.append("   • loaded warehouse.sales_managers")
+        report.append("   • loaded warehouse.sales")
+
+        # ───────────────────────────────────────────────────────────────────────────────
+        #  2.6+2.7) TRAFFIC_SOURCES → warehouse.traffic_sources, then USER_TRAFFIC (SCD2 full from
+        #           “source” side) resolved against its RETURNING rows; a second sub‐step loads the CSV
+        # ───────────────────────────────────────────────────────────────────────────────
+
+        #  2.7.a) All “source.user_traffic” rows → warehouse.user_traffic (SCD2 full, source_id_audit = 1)
+        conn.execute(text(f"""
+            WITH traffic_ins AS (
+              --  2.6) TRAFFIC_SOURCES → warehouse.traffic_sources (SCD2 full)
+              INSERT INTO warehouse.traffic_sources
+                (source_id, name, channel, details, row_hash,
+                 start_date, end_date, source_id_audit, insert_id, update_id)
+              SELECT
+                t.source_id,
+                t.name,
+                t.channel,
+                t.details,
+                {TRAFFIC_SOURCE_ROW_HASH_SQL.format(t="t")} AS row_hash,
+                :now_ts             AS start_date,
+                '9999-12-31'::DATE  AS end_date,
+                :src_main           AS source_id_audit,
+                :batch              AS insert_id,
+                NULL                AS update_id
+              FROM source.traffic_sources AS t
+              RETURNING traffic_source_sk, source_id
+            )
+            INSERT INTO warehouse.user_traffic
+              (user_sk, traffic_source_sk, referred_at, campaign_code,
                start_date, end_date, source_id_audit, insert_id, update_id)
             SELECT
-              t.source_id,
-              t.name,
-              t.channel,
-              t.details,
-              NOW()               AS start_date,
+              u.user_sk,
+              t.traffic_source_sk,
+              ut.referred_at,
+              ut.campaign_code,
+              :now_ts             AS start_date,
               '9999-12-31'::DATE  AS end_date,
               :src_main           AS source_id_audit,
               :batch              AS insert_id,
               NULL                AS update_id
-            FROM source.traffic_sources AS t;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • loaded warehouse.traffic_sources")
-
-    # ───────────────────────────────────────────────────────────────────────────────
-    #  2.7) USER_TRAFFIC → warehouse.user_traffic (SCD2 full from “source” side)
-    #        (this is exactly as before, except we now tack on a second sub‐step for CSV)
-    # ───────────────────────────────────────────────────────────────────────────────
-
-    #  2.7.a) All “source.user_traffic” rows → warehouse.user_traffic (SCD2 full, source_id_audit = 1)
-    with warehouse_engine.begin() as conn:
+            FROM source.user_traffic AS ut
+            JOIN warehouse.users AS u
+              ON ut.user_id = u.user_id
+             AND u.end_date = '9999-12-31'::DATE
+            JOIN traffic_ins AS t
+              ON ut.source_id = t.source_id;
+        """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+        report.append("   • loaded warehouse.traffic_sources")
+        report.append("   • loaded warehouse.user_traffic from source.user_traffic (source_id_audit=1)")
+
+        # ───────────────────────────────────────────────────────────────────────────────
+        #  2.7.b) Now load every row from CSV → warehouse.user_traffic (as if new, source_id_audit = 2)
+        #        * Full‐load version simply “truncates” domain above, so we can insert _all_ CSV rows fresh
+        # ───────────────────────────────────────────────────────────────────────────────
+        #
+        # The CSV is COPY'd into the UNLOGGED staging.user_traffic_csv table, then a single
+        # INSERT … SELECT looks up u.user_sk and t.traffic_source_sk for every staged row at once
+        # and inserts with start_date=now_ts, end_date='9999-12-31', source_id_audit = 2.
+        #
+        stage_user_traffic_csv(conn)
         conn.execute(text("""
             INSERT INTO warehouse.user_traffic
               (user_sk, traffic_source_sk, referred_at, campaign_code,
@@ -233,87 +422,43 @@ def run_full_load():
             SELECT
               u.user_sk,
               t.traffic_source_sk,
-              ut.referred_at,
-              ut.campaign_code,
-              NOW()               AS start_date,
+              s.referred_at,
+              s.campaign_code,
+              :now_ts             AS start_date,
               '9999-12-31'::DATE  AS end_date,
-              :src_main           AS source_id_audit,
+              :csv_audit          AS source_id_audit,
               :batch              AS insert_id,
               NULL                AS update_id
-            FROM source.user_traffic AS ut
+            FROM staging.user_traffic_csv AS s
             JOIN warehouse.users AS u
-              ON ut.user_id = u.user_id
+              ON u.user_id = s.user_id
              AND u.end_date = '9999-12-31'::DATE
             JOIN warehouse.traffic_sources AS t
-              ON ut.source_id = t.source_id
+              ON t.source_id = s.source_id
              AND t.end_date = '9999-12-31'::DATE;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • loaded warehouse.user_traffic from source.user_traffic (source_id_audit=1)")
+        """), {"now_ts": now_ts, "csv_audit": SRC_CSV_AUDIT_ID, "batch": batch_id})
+        report.append("   • loaded warehouse.user_traffic from CSV (source_id_audit=2)")
 
-    # ───────────────────────────────────────────────────────────────────────────────
-    #  2.7.b) Now load every row from CSV → warehouse.user_traffic (as if new, source_id_audit = 2)
-    #        * Full‐load version simply “truncates” domain above, so we can insert _all_ CSV rows fresh
-    # ───────────────────────────────────────────────────────────────────────────────
-    #
-    # We must look up u.user_sk  and t.traffic_source_sk by joining against warehouse.users/traffic_sources;
-    # then we insert with start_date=NOW(), end_date='9999-12-31', source_id_audit = 2.
-    #
-    # NB: We assume the CSV columns are exactly: user_id, source_id, referred_at (ISO‐timestamp), campaign_code
-    #
-    with warehouse_engine.begin() as conn:
-        reader = csv.DictReader(open(CSV_PATH, newline=""))
-        rows_to_insert = []
-        for row in reader:
-            # Each row in the CSV has user_id, source_id, referred_at, campaign_code
-            # We’ll pass these as params to the SELECT … INSERT; the SELECT will lookup user_sk & traffic_source_sk.
-            rows_to_insert.append({
-                "user_id"      : row["user_id"],
-                "source_id"    : row["source_id"],
-                "referred_at"  : row["referred_at"],
-                "campaign_code": row["campaign_code"],
-            })
-
-        # If there are no rows in the CSV, skip the block:
-        if rows_to_insert:
-            conn.execute(text("""
-                INSERT INTO warehouse.user_traffic
-                  (user_sk, traffic_source_sk, referred_at, campaign_code,
-                   start_date, end_date, source_id_audit, insert_id, update_id)
-                SELECT
-                  u.user_sk,
-                  t.traffic_source_sk,
-                  CAST(:referred_at AS TIMESTAMP),
-                  :campaign_code,
-                  NOW()               AS start_date,
-                  '9999-12-31'::DATE  AS end_date,
-                  :csv_audit          AS source_id_audit,
-                  :batch              AS insert_id,
-                  NULL                AS update_id
-                FROM warehouse.users AS u
-                JOIN warehouse.traffic_sources AS t
-                  ON t.source_id = :source_id
-                 AND t.end_date = '9999-12-31'::DATE
-                WHERE u.user_id = :user_id
-                  AND u.end_date = '9999-12-31'::DATE;
-            """), [
-                {
-                    "user_id"      : r["user_id"],
-                    "source_id"    : r["source_id"],
-                    "referred_at"  : r["referred_at"],
-                    "campaign_code": r["campaign_code"],
-                    "csv_audit"    : SRC_CSV_AUDIT_ID,
-                    "batch"        : batch_id
-                }
-                for r in rows_to_insert
-            ])
-    print("   • loaded warehouse.user_traffic from CSV (source_id_audit=2)\n")
+        # The tables were just truncated and bulk‐filled; refresh statistics so the star_schema
+        # joins below are planned against the loaded row counts instead of empty‐table estimates.
+        conn.execute(text("""
+            ANALYZE warehouse.users, warehouse.sales_managers, warehouse.courses, warehouse.enrollments,
+                    warehouse.sales, warehouse.traffic_sources, warehouse.user_traffic;
+        """))
+        report.append("   • analyzed warehouse tables\n")
 
-    # ───────────────────────────────────────────────────────────────────────────────
-    #  3) Build “star_schema” dims & fact, each in its own transaction (UNCHANGED)
-    # ───────────────────────────────────────────────────────────────────────────────
+        # ───────────────────────────────────────────────────────────────────────────────
+        #  3) Build “star_schema” dims & fact
+        # ───────────────────────────────────────────────────────────────────────────────
 
-    #  3.1) dim_user
-    with warehouse_engine.begin() as conn:
+        #  3.0) Drop FK + UNIQUE constraints and plain indexes so the bulk INSERTs below skip
+        #       per‐row index maintenance (definitions are kept for 3.7)
+        star_ddl = star_schema_bulk_ddl(conn)
+        for drop_sql, _ in star_ddl:
+            conn.execute(text(drop_sql))
+        report.append("   • dropped star_schema FK/UNIQUE constraints and indexes for bulk rebuild")
+
+        #  3.1) dim_user
         conn.execute(text("""
             INSERT INTO star_schema.dim_user
               (user_key, user_id, first_name, last_name, email, signup_date, country)
@@ -328,10 +473,9 @@ def run_full_load():
             FROM warehouse.users AS u
             WHERE u.end_date = '9999-12-31'::DATE;
         """))
-    print("   • loaded star_schema.dim_user")
+        report.append("   • loaded star_schema.dim_user")
 
-    #  3.2) dim_course
-    with warehouse_engine.begin() as conn:
+        #  3.2) dim_course
         conn.execute(text("""
             INSERT INTO star_schema.dim_course
               (course_key, course_id, title, subject, price_in_rubbles, category, sub_category)
@@ -346,10 +490,9 @@ def run_full_load():
             FROM warehouse.courses AS c
             WHERE c.end_date = '9999-12-31'::DATE;
         """))
-    print("   • loaded star_schema.dim_course")
+        report.append("   • loaded star_schema.dim_course")
 
-    #  3.3) dim_traffic_source
-    with warehouse_engine.begin() as conn:
+        #  3.3) dim_traffic_source
         conn.execute(text("""
             INSERT INTO star_schema.dim_traffic_source
               (traffic_source_key, traffic_source_id, name, channel)
@@ -361,10 +504,16 @@ def run_full_load():
             FROM warehouse.traffic_sources AS t
             WHERE t.end_date = '9999-12-31'::DATE;
         """))
-    print("   • loaded star_schema.dim_traffic_source")
+        # Sentinel row for sales whose user has no active referral (fact_sales uses COALESCE(..., -1))
+        conn.execute(text("""
+            INSERT INTO star_schema.dim_traffic_source
+              (traffic_source_key, traffic_source_id, name, channel)
+            VALUES (-1, -1, 'unknown', 'unknown')
+            ON CONFLICT (traffic_source_key) DO NOTHING;
+        """))
+        report.append("   • loaded star_schema.dim_traffic_source")
 
-    #  3.4) dim_sales_manager
-    with warehouse_engine.begin() as conn:
+        #  3.4) dim_sales_manager
         conn.execute(text("""
             INSERT INTO star_schema.dim_sales_manager
               (sales_manager_key, manager_id, first_name, last_name, email, hired_at)
@@ -378,291 +527,224 @@ def run_full_load():
             FROM warehouse.sales_managers AS m
             WHERE m.end_date = '9999-12-31'::DATE;
         """))
-    print("   • loaded star_schema.dim_sales_manager")
+        report.append("   • loaded star_schema.dim_sales_manager")
 
-    #  3.5) dim_date
-    with warehouse_engine.begin() as conn:
+        #  3.5) dim_date
+        #       One pass over each dated column (UNION ALL) yields both bounds,
+        #       instead of a separate MIN and MAX scan per table.
         result = conn.execute(text("""
             SELECT
-              (SELECT MIN(registered_at)::DATE     FROM warehouse.users      ) AS min_u,
-              (SELECT MIN(created_at)::DATE        FROM warehouse.courses    ) AS min_c,
-              (SELECT MIN(enrolled_at)::DATE       FROM warehouse.enrollments) AS min_e,
-              (SELECT MIN(sale_date)::DATE         FROM warehouse.sales       ) AS min_s,
-              (SELECT MIN(referred_at)::DATE       FROM warehouse.user_traffic) AS min_ut,
-
-              (SELECT MAX(registered_at)::DATE     FROM warehouse.users      ) AS max_u,
-              (SELECT MAX(created_at)::DATE        FROM warehouse.courses    ) AS max_c,
-              (SELECT MAX(enrolled_at)::DATE       FROM warehouse.enrollments) AS max_e,
-              (SELECT MAX(sale_date)::DATE         FROM warehouse.sales       ) AS max_s,
-              (SELECT MAX(referred_at)::DATE       FROM warehouse.user_traffic) AS max_ut
+              MIN(d)::DATE AS min_date,
+              MAX(d)::DATE AS max_date
+            FROM (
+              SELECT registered_at AS d FROM warehouse.users
+              UNION ALL
+              SELECT created_at          FROM warehouse.courses
+              UNION ALL
+              SELECT enrolled_at         FROM warehouse.enrollments
+              UNION ALL
+              SELECT sale_date           FROM warehouse.sales
+              UNION ALL
+              SELECT referred_at         FROM warehouse.user_traffic
+            ) AS all_dates;
         """)).mappings().one()
 
-    min_candidates = [
-        result["min_u"],
-        result["min_c"],
-        result["min_e"],
-        result["min_s"],
-        result["min_ut"]
-    ]
-    max_candidates = [
-        result["max_u"],
-        result["max_c"],
-        result["max_e"],
-        result["max_s"],
-        result["max_ut"]
-    ]
-
-    min_date = min([d for d in min_candidates if d is not None], default=datetime.date.today())
-    max_date = max([d for d in max_candidates if d is not None], default=datetime.date.today())
+        min_date = result["min_date"] or datetime.date.today()
+        max_date = result["max_date"] or datetime.date.today()
 
-    with warehouse_engine.begin() as conn:
-        conn.execute(text(f"""
-            INSERT INTO star_schema.dim_date
-              (date_key, date, year, quarter, month, day, weekday)
-            SELECT
-              TO_CHAR(gs::DATE, 'YYYYMMDD')::INT AS date_key,
-              gs::DATE                            AS date,
-              EXTRACT(YEAR   FROM gs)::INT        AS year,
-              EXTRACT(QUARTER FROM gs)::INT       AS quarter,
-              EXTRACT(MONTH  FROM gs)::INT        AS month,
-              EXTRACT(DAY    FROM gs)::INT        AS day,
-              EXTRACT(DOW    FROM gs)::INT        AS weekday
-            FROM generate_series(
-              '{min_date}'::DATE,
-              '{max_date}'::DATE,
-              '1 day'::INTERVAL
-            ) AS gs;
-        """))
-    total_days = (max_date - min_date).days + 1
-    print(f"   • loaded star_schema.dim_date ({total_days} days from {min_date} to {max_date})")
+        total_days = copy_dim_date(conn, min_date, max_date)
+        report.append(f"   • loaded star_schema.dim_date ({total_days} days from {min_date} to {max_date})")
 
-    #  3.6) fact_sales
-    with warehouse_engine.begin() as conn:
+        # Same for the freshly loaded dims, which the fact_sales INSERT joins against
         conn.execute(text("""
-                INSERT INTO star_schema.fact_sales
-      (sale_id, user_key, course_key, sales_manager_key, traffic_source_key, date_key,
-       total_in_rubbles, enrollment_count)
-    SELECT
-      s.sale_id,
-      e.user_sk                   AS user_key,
-      e.course_sk                 AS course_key,
-      s.sales_manager_sk          AS sales_manager_key,
-      COALESCE(ut.traffic_source_sk, -1) AS traffic_source_key,
-      dd.date_key,
-      s.cost_in_rubbles           AS total_in_rubbles,
-      1                           AS enrollment_count
-    FROM warehouse.sales AS s
-    JOIN warehouse.enrollments AS e 
-      ON s.enrollment_sk = e.enrollment_sk
-    LEFT JOIN (
-      SELECT DISTINCT ON (user_sk)
-         user_sk,
-         traffic_source_sk,
-         referred_at,
-         campaign_code
-      FROM warehouse.user_traffic
-      WHERE end_date = '9999-12-31'::DATE
-      ORDER BY user_sk, referred_at DESC
-      -- ^ “Distinct on (user_sk)” picks the single ACTIVE row with the latest referred_at per user
-    ) AS ut
-      ON e.user_sk = ut.user_sk
-    JOIN star_schema.dim_date AS dd 
-      ON s.sale_date::DATE = dd.date
-    WHERE s.end_date = '9999-12-31'::DATE;
-
+            ANALYZE star_schema.dim_user, star_schema.dim_course, star_schema.dim_traffic_source,
+                    star_schema.dim_sales_manager, star_schema.dim_date;
         """))
-    print("   • loaded star_schema.fact_sales\n")
+        report.append("   • analyzed star_schema dims")
 
-    print(f"[{datetime.datetime.now(pytz.UTC)}] ✅ FULL load complete.\n")
+        #  3.6) fact_sales
+        conn.execute(text("""
+            INSERT INTO star_schema.fact_sales
+              (sale_id, user_key, course_key, sales_manager_key, traffic_source_key, date_key,
+               total_in_rubbles, enrollment_count)
+            SELECT
+              s.sale_id,
+              e.user_sk                   AS user_key,
+              e.course_sk                 AS course_key,
+              s.sales_manager_sk          AS sales_manager_key,
+              COALESCE(ut.traffic_source_sk, -1) AS traffic_source_key,
+              dd.date_key,
+              s.cost_in_rubbles           AS total_in_rubbles,
+              1                           AS enrollment_count
+            FROM warehouse.sales AS s
+            JOIN warehouse.enrollments AS e
+              ON s.enrollment_sk = e.enrollment_sk
+            LEFT JOIN (
+              SELECT DISTINCT ON (user_sk)
+                user_sk,
+                traffic_source_sk,
+                referred_at,
+                campaign_code
+              FROM warehouse.user_traffic
+              WHERE end_date = '9999-12-31'::DATE
+              ORDER BY user_sk, referred_at DESC
+              -- ^ “Distinct on (user_sk)” picks the single ACTIVE row with the latest referred_at per user
+            ) AS ut
+              ON e.user_sk = ut.user_sk
+            JOIN star_schema.dim_date AS dd
+              ON s.sale_date_d = dd.date
+            WHERE s.end_date = '9999-12-31'::DATE;
+        """))
+        report.append("   • loaded star_schema.fact_sales")
+
+        #  3.7) Re‐create what 3.0 dropped (UNIQUE first, then indexes, then FKs: each built in one pass)
+        for _, create_sql in reversed(star_ddl):
+            conn.execute(text(create_sql))
+        report.append("   • re‐created star_schema FK/UNIQUE constraints and indexes")
+        conn.execute(text("ANALYZE star_schema.fact_sales"))
+        report.append("   • analyzed star_schema.fact_sales")
+
+        #  3.8) Re‐aggregate star_schema.fact_sales_daily (plain REFRESH: also populates it the first time)
+        if fact_sales_daily_state(conn) is None:
+            report.append("   • skipped star_schema.fact_sales_daily: view missing, run create_star_schema.py\n")
+        else:
+            conn.execute(text("REFRESH MATERIALIZED VIEW star_schema.fact_sales_daily"))
+            report.append("   • refreshed star_schema.fact_sales_daily\n")
 
+    for line in report:
+        print(line)
 
+    print(f"[{datetime.datetime.now(pytz.UTC)}] ✅ FULL load complete.\n")
 
-def run_incremental_load(batch_id: int):
-    now_ts = datetime.datetime.now(pytz.UTC)
-    print(f"[{now_ts}] ▶️  Starting INCREMENTAL load (batch_id={batch_id})\n")
-
-    # ───────────────────────────────────────────────────────────────────────────────
-    #  1) Incrementally update “warehouse” schema with SCD2 logic, one-step-per-txn
-    # ───────────────────────────────────────────────────────────────────────────────
 
+def scd2_users(conn, batch_id, now_ts, report):
+    """
+    SCD2 step for warehouse.users, including closing out users deleted at the source.
+    """
     #  1.1) USERS (unchanged)
-    with warehouse_engine.begin() as conn:
-        #  1.1.a) Insert brand-new users
-        conn.execute(text("""
-            INSERT INTO warehouse.users (
-                user_id, first_name, last_name, email, phone, country, registered_at,
-                start_date, end_date, source_id, insert_id, update_id
-            )
+    #  Insert brand‐new users, close out changed ones and insert their new versions in one statement:
+    #  the change‐set (new rows have no old_sk) is materialized once and drives both the UPDATE and the INSERT
+    conn.execute(text("""
+        WITH changed AS MATERIALIZED (
             SELECT
+                w.user_sk           AS old_sk,
                 s.user_id,
                 s.first_name,
                 s.last_name,
                 s.email,
                 s.phone,
                 s.country,
-                s.registered_at,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
+                s.registered_at
             FROM source.users AS s
             LEFT JOIN warehouse.users AS w
-              ON s.user_id = w.user_id
-                 AND w.end_date = '9999-12-31'::DATE
-            WHERE w.user_id IS NULL;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new warehouse.users")
-
-    with warehouse_engine.begin() as conn:
-        #  1.1.b) Insert new versions for changed users
-        conn.execute(text("""
-            INSERT INTO warehouse.users (
-                user_id, first_name, last_name, email, phone, country, registered_at,
-                start_date, end_date, source_id, insert_id, update_id
-            )
-            SELECT
-                s.user_id,
-                s.first_name,
-                s.last_name,
-                s.email,
-                s.phone,
-                s.country,
-                s.registered_at,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
-            FROM source.users AS s
-            JOIN warehouse.users AS w
               ON s.user_id = w.user_id
              AND w.end_date = '9999-12-31'::DATE
-            WHERE 
-                  s.first_name    IS DISTINCT FROM w.first_name
-              OR  s.last_name     IS DISTINCT FROM w.last_name
-              OR  s.email         IS DISTINCT FROM w.email
-              OR  s.phone         IS DISTINCT FROM w.phone
-              OR  s.country       IS DISTINCT FROM w.country
-              OR  s.registered_at IS DISTINCT FROM w.registered_at;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new versions for changed warehouse.users")
-
-    with warehouse_engine.begin() as conn:
-        #  1.1.c) Close out old active user records
-        conn.execute(text("""
+            WHERE w.user_sk IS NULL
+               OR (s.first_name, s.last_name, s.email, s.phone, s.country, s.registered_at)
+                  IS DISTINCT FROM
+                  (w.first_name, w.last_name, w.email, w.phone, w.country, w.registered_at)
+        ),
+        closed AS (
             UPDATE warehouse.users AS w
-               SET end_date  = NOW(),
+               SET end_date  = :now_ts,
                    update_id = :batch
-            FROM source.users AS s
-            WHERE w.user_id = s.user_id
-              AND w.end_date = '9999-12-31'::DATE
-              AND (
-                    s.first_name    IS DISTINCT FROM w.first_name
-                OR  s.last_name     IS DISTINCT FROM w.last_name
-                OR  s.email         IS DISTINCT FROM w.email
-                OR  s.phone         IS DISTINCT FROM w.phone
-                OR  s.country       IS DISTINCT FROM w.country
-                OR  s.registered_at IS DISTINCT FROM w.registered_at
-              );
-        """), {"batch": batch_id})
-    print("   • closed out old versions of warehouse.users\n")
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            UPDATE warehouse.users AS w
-               SET end_date  = NOW(),
-                   update_id = :batch
-            WHERE w.end_date = '9999-12-31'::DATE
-              AND NOT EXISTS (
-                  SELECT 1
-                    FROM source.users AS s
-                   WHERE s.user_id = w.user_id
-              );
-        """), {"batch": batch_id})
+              FROM changed AS c
+             WHERE w.user_sk = c.old_sk
+        )
+        INSERT INTO warehouse.users (
+            user_id, first_name, last_name, email, phone, country, registered_at,
+            start_date, end_date, source_id, insert_id, update_id
+        )
+        SELECT
+            c.user_id,
+            c.first_name,
+            c.last_name,
+            c.email,
+            c.phone,
+            c.country,
+            c.registered_at,
+            :now_ts             AS start_date,
+            '9999-12-31'::DATE  AS end_date,
+            :src_main           AS source_id,
+            :batch              AS insert_id,
+            NULL                AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+    report.append("   • inserted new and re‐versioned changed warehouse.users\n")
+    conn.execute(text("""
+        UPDATE warehouse.users AS w
+           SET end_date  = :now_ts,
+               update_id = :batch
+        WHERE w.end_date = '9999-12-31'::DATE
+          AND NOT EXISTS (
+              SELECT 1
+                FROM source.users AS s
+               WHERE s.user_id = w.user_id
+          );
+    """), {"now_ts": now_ts, "batch": batch_id})
+
+
+def scd2_sales_managers(conn, batch_id, now_ts, report):
+    """
+    SCD2 step for warehouse.sales_managers.
+    """
     #  1.2) SALES_MANAGERS (unchanged)
-    with warehouse_engine.begin() as conn:
-        #  1.2.a) Insert brand-new sales_managers
-        conn.execute(text("""
-            INSERT INTO warehouse.sales_managers (
-                manager_id, first_name, last_name, email, hired_at,
-                start_date, end_date, source_id, insert_id, update_id
-            )
+    #  Insert brand‐new sales_managers, close out changed ones and insert their new versions in one statement:
+    #  the change‐set (new rows have no old_sk) is materialized once and drives both the UPDATE and the INSERT
+    conn.execute(text("""
+        WITH changed AS MATERIALIZED (
             SELECT
+                w.sales_manager_sk  AS old_sk,
                 s.manager_id,
                 s.first_name,
                 s.last_name,
                 s.email,
-                s.hired_at,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
+                s.hired_at
             FROM source.sales_managers AS s
             LEFT JOIN warehouse.sales_managers AS w
-              ON s.manager_id = w.manager_id
-                 AND w.end_date = '9999-12-31'::DATE
-            WHERE w.manager_id IS NULL;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new warehouse.sales_managers")
-
-    with warehouse_engine.begin() as conn:
-        #  1.2.b) Insert new versions for changed sales_managers
-        conn.execute(text("""
-            INSERT INTO warehouse.sales_managers (
-                manager_id, first_name, last_name, email, hired_at,
-                start_date, end_date, source_id, insert_id, update_id
-            )
-            SELECT
-                s.manager_id,
-                s.first_name,
-                s.last_name,
-                s.email,
-                s.hired_at,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
-            FROM source.sales_managers AS s
-            JOIN warehouse.sales_managers AS w
               ON s.manager_id = w.manager_id
              AND w.end_date = '9999-12-31'::DATE
-            WHERE 
-                  s.first_name IS DISTINCT FROM w.first_name
-              OR  s.last_name  IS DISTINCT FROM w.last_name
-              OR  s.email      IS DISTINCT FROM w.email
-              OR  s.hired_at   IS DISTINCT FROM w.hired_at;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new versions for changed warehouse.sales_managers")
-
-    with warehouse_engine.begin() as conn:
-        #  1.2.c) Close out old active sales_managers
-        conn.execute(text("""
+            WHERE w.sales_manager_sk IS NULL
+               OR (s.first_name, s.last_name, s.email, s.hired_at)
+                  IS DISTINCT FROM
+                  (w.first_name, w.last_name, w.email, w.hired_at)
+        ),
+        closed AS (
             UPDATE warehouse.sales_managers AS w
-               SET end_date     = NOW(),
-                   update_id    = :batch
-            FROM source.sales_managers AS s
-            WHERE w.manager_id = s.manager_id
-              AND w.end_date = '9999-12-31'::DATE
-              AND (
-                    s.first_name IS DISTINCT FROM w.first_name
-                OR  s.last_name  IS DISTINCT FROM w.last_name
-                OR  s.email      IS DISTINCT FROM w.email
-                OR  s.hired_at   IS DISTINCT FROM w.hired_at
-              );
-        """), {"batch": batch_id})
-    print("   • closed out old versions of warehouse.sales_managers\n")
-
+               SET end_date  = :now_ts,
+                   update_id = :batch
+              FROM changed AS c
+             WHERE w.sales_manager_sk = c.old_sk
+        )
+        INSERT INTO warehouse.sales_managers (
+            manager_id, first_name, last_name, email, hired_at,
+            start_date, end_date, source_id, insert_id, update_id
+        )
+        SELECT
+            c.manager_id,
+            c.first_name,
+            c.last_name,
+            c.email,
+            c.hired_at,
+            :now_ts             AS start_date,
+            '9999-12-31'::DATE  AS end_date,
+            :src_main           AS source_id,
+            :batch              AS insert_id,
+            NULL                AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+    report.append("   • inserted new and re‐versioned changed warehouse.sales_managers\n")
+
+
+def scd2_courses(conn, batch_id, now_ts, report):
+    """
+    SCD2 step for warehouse.courses (category names resolved from source.categories/subcategories).
+    """
     #  1.3) COURSES (unchanged)
-    with warehouse_engine.begin() as conn:
-        #  1.3.a) Insert brand-new courses
-        conn.execute(text("""
-            INSERT INTO warehouse.courses (
-                course_id, title, subject, description, price_in_rubbles, created_at,
-                category, sub_category,
-                start_date, end_date, source_id, insert_id, update_id
-            )
+    #  Insert brand‐new courses, close out changed ones and insert their new versions in one statement:
+    #  the change‐set (new rows have no old_sk) is materialized once and drives both the UPDATE and the INSERT
+    conn.execute(text(f"""
+        WITH src AS (
             SELECT
                 s.course_id,
                 s.title,
@@ -672,136 +754,80 @@ def run_incremental_load(batch_id: int):
                 s.created_at,
                 cat.name                 AS category,
                 sub.name                 AS sub_category,
-                NOW()                    AS start_date,
-                '9999-12-31'::DATE       AS end_date,
-                :src_main                AS source_id,
-                :batch                   AS insert_id,
-                NULL                     AS update_id
+                {COURSE_ROW_HASH_SQL.format(c="s", category="cat.name", sub_category="sub.name")} AS row_hash
             FROM source.courses AS s
             JOIN source.categories    AS cat ON s.category_id    = cat.category_id
             JOIN source.subcategories AS sub ON s.subcategory_id = sub.subcategory_id
-            LEFT JOIN warehouse.courses AS w
-              ON s.course_id = w.course_id
-                 AND w.end_date = '9999-12-31'::DATE
-            WHERE w.course_id IS NULL;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new warehouse.courses")
-
-    with warehouse_engine.begin() as conn:
-        #  1.3.b) Insert new versions for changed courses
-        conn.execute(text("""
-            INSERT INTO warehouse.courses (
-                course_id, title, subject, description, price_in_rubbles, created_at,
-                category, sub_category,
-                start_date, end_date, source_id, insert_id, update_id
-            )
+        ),
+        changed AS MATERIALIZED (
             SELECT
+                w.course_sk         AS old_sk,
                 s.course_id,
                 s.title,
                 s.subject,
                 s.description,
                 s.price_in_rubbles,
                 s.created_at,
-                cat.name                 AS category,
-                sub.name                 AS sub_category,
-                NOW()                    AS start_date,
-                '9999-12-31'::DATE       AS end_date,
-                :src_main                AS source_id,
-                :batch                   AS insert_id,
-                NULL                     AS update_id
-            FROM source.courses AS s
-            JOIN warehouse.courses AS w
+                s.category,
+                s.sub_category,
+                s.row_hash
+            FROM src AS s
+            LEFT JOIN warehouse.courses AS w
               ON s.course_id = w.course_id
              AND w.end_date = '9999-12-31'::DATE
-            JOIN source.categories    AS cat ON s.category_id    = cat.category_id
-            JOIN source.subcategories AS sub ON s.subcategory_id = sub.subcategory_id
-            WHERE 
-                  s.title             IS DISTINCT FROM w.title
-              OR  s.subject           IS DISTINCT FROM w.subject
-              OR  COALESCE(s.description, '') <> COALESCE(w.description, '')
-              OR  s.price_in_rubbles  IS DISTINCT FROM w.price_in_rubbles
-              OR  s.created_at        IS DISTINCT FROM w.created_at
-              OR  cat.name            IS DISTINCT FROM w.category
-              OR  sub.name            IS DISTINCT FROM w.sub_category;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new versions for changed warehouse.courses")
-
-    with warehouse_engine.begin() as conn:
-        #  1.3.c) Close out old active courses
-        conn.execute(text("""
+            WHERE w.course_sk IS NULL
+               OR s.row_hash IS DISTINCT FROM w.row_hash
+        ),
+        closed AS (
             UPDATE warehouse.courses AS w
-               SET end_date  = NOW(),
+               SET end_date  = :now_ts,
                    update_id = :batch
-            FROM source.courses AS s
-            JOIN source.categories    AS cat ON s.category_id    = cat.category_id
-            JOIN source.subcategories AS sub ON s.subcategory_id = sub.subcategory_id
-            WHERE w.course_id = s.course_id
-              AND w.end_date = '9999-12-31'::DATE
-              AND (
-                    s.title             IS DISTINCT FROM w.title
-                OR  s.subject           IS DISTINCT FROM w.subject
-                OR  COALESCE(s.description, '') <> COALESCE(w.description, '')
-                OR  s.price_in_rubbles  IS DISTINCT FROM w.price_in_rubbles
-                OR  s.created_at        IS DISTINCT FROM w.created_at
-                OR  cat.name            IS DISTINCT FROM w.category
-                OR  sub.name            IS DISTINCT FROM w.sub_category
-              );
-        """), {"batch": batch_id})
-    print("   • closed out old versions of warehouse.courses\n")
-
+              FROM changed AS c
+             WHERE w.course_sk = c.old_sk
+        )
+        INSERT INTO warehouse.courses (
+            course_id, title, subject, description, price_in_rubbles, created_at,
+            category, sub_category, row_hash,
+            start_date, end_date, source_id, insert_id, update_id
+        )
+        SELECT
+            c.course_id,
+            c.title,
+            c.subject,
+            c.description,
+            c.price_in_rubbles,
+            c.created_at,
+            c.category,
+            c.sub_category,
+            c.row_hash,
+            :now_ts                  AS start_date,
+            '9999-12-31'::DATE       AS end_date,
+            :src_main                AS source_id,
+            :batch                   AS insert_id,
+            NULL                     AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+    report.append("   • inserted new and re‐versioned changed warehouse.courses\n")
+
+
+def scd2_enrollments(conn, batch_id, now_ts, report):
+    """
+    SCD2 step for warehouse.enrollments. Needs users and courses to be current.
+    """
     #  1.4) ENROLLMENTS (unchanged)
-    with warehouse_engine.begin() as conn:
-        #  1.4.a) Insert brand-new enrollments
-        conn.execute(text("""
-            INSERT INTO warehouse.enrollments (
-                enrollment_id, user_sk, course_sk, enrolled_at, status,
-                start_date, end_date, source_id, insert_id, update_id
-            )
+    #  Insert brand‐new enrollments, close out changed ones and insert their new versions in one statement:
+    #  the change‐set (new rows have no old_sk) is materialized once and drives both the UPDATE and the INSERT
+    conn.execute(text("""
+        WITH changed AS MATERIALIZED (
             SELECT
+                w.enrollment_sk     AS old_sk,
                 s.enrollment_id,
                 u.user_sk,
                 c.course_sk,
                 s.enrolled_at,
-                s.status,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
+                s.status
             FROM source.enrollments AS s
-            JOIN warehouse.users AS u
-              ON s.user_id = u.user_id
-             AND u.end_date = '9999-12-31'::DATE
-            JOIN warehouse.courses AS c
-              ON s.course_id = c.course_id
-             AND c.end_date = '9999-12-31'::DATE
             LEFT JOIN warehouse.enrollments AS w
-              ON s.enrollment_id = w.enrollment_id
-                 AND w.end_date = '9999-12-31'::DATE
-            WHERE w.enrollment_id IS NULL;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new warehouse.enrollments")
-
-    with warehouse_engine.begin() as conn:
-        #  1.4.b) Insert new versions for changed enrollments
-        conn.execute(text("""
-            INSERT INTO warehouse.enrollments (
-                enrollment_id, user_sk, course_sk, enrolled_at, status,
-                start_date, end_date, source_id, insert_id, update_id
-            )
-            SELECT
-                s.enrollment_id,
-                u.user_sk,
-                c.course_sk,
-                s.enrolled_at,
-                s.status,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
-            FROM source.enrollments AS s
-            JOIN warehouse.enrollments AS w
               ON s.enrollment_id = w.enrollment_id
              AND w.end_date = '9999-12-31'::DATE
             JOIN warehouse.users AS u
@@ -810,107 +836,60 @@ def run_incremental_load(batch_id: int):
             JOIN warehouse.courses AS c
               ON s.course_id = c.course_id
              AND c.end_date = '9999-12-31'::DATE
-            WHERE 
-                  s.user_id     IS DISTINCT FROM (
-                    SELECT x.user_id 
-                    FROM warehouse.users x 
-                    WHERE x.user_sk = w.user_sk
-                  )
-              OR  s.course_id   IS DISTINCT FROM (
-                    SELECT y.course_id 
-                    FROM warehouse.courses y 
-                    WHERE y.course_sk = w.course_sk
-                  )
-              OR  s.enrolled_at IS DISTINCT FROM w.enrolled_at
-              OR  s.status      IS DISTINCT FROM w.status;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new versions for changed warehouse.enrollments")
-
-    with warehouse_engine.begin() as conn:
-        #  1.4.c) Close out old active enrollments
-        conn.execute(text("""
+            LEFT JOIN warehouse.users AS wu
+              ON wu.user_sk = w.user_sk
+            LEFT JOIN warehouse.courses AS wc
+              ON wc.course_sk = w.course_sk
+            WHERE w.enrollment_sk IS NULL
+               OR (s.user_id, s.course_id, s.enrolled_at, s.status)
+                  IS DISTINCT FROM
+                  (wu.user_id, wc.course_id, w.enrolled_at, w.status)
+        ),
+        closed AS (
             UPDATE warehouse.enrollments AS w
-               SET end_date  = NOW(),
+               SET end_date  = :now_ts,
                    update_id = :batch
-            FROM source.enrollments AS s
-            JOIN warehouse.users AS u
-              ON s.user_id = u.user_id
-             AND u.end_date = '9999-12-31'::DATE
-            JOIN warehouse.courses AS c
-              ON s.course_id = c.course_id
-             AND c.end_date = '9999-12-31'::DATE
-            WHERE w.enrollment_id = s.enrollment_id
-              AND w.end_date = '9999-12-31'::DATE
-              AND (
-                    s.user_id     IS DISTINCT FROM (
-                      SELECT x.user_id 
-                      FROM warehouse.users x 
-                      WHERE x.user_sk = w.user_sk
-                    )
-                OR  s.course_id   IS DISTINCT FROM (
-                      SELECT y.course_id 
-                      FROM warehouse.courses y 
-                      WHERE y.course_sk = w.course_sk
-                    )
-                OR  s.enrolled_at IS DISTINCT FROM w.enrolled_at
-                OR  s.status      IS DISTINCT FROM w.status
-              );
-        """), {"batch": batch_id})
-    print("   • closed out old versions of warehouse.enrollments\n")
-
+              FROM changed AS c
+             WHERE w.enrollment_sk = c.old_sk
+        )
+        INSERT INTO warehouse.enrollments (
+            enrollment_id, user_sk, course_sk, enrolled_at, status,
+            start_date, end_date, source_id, insert_id, update_id
+        )
+        SELECT
+            c.enrollment_id,
+            c.user_sk,
+            c.course_sk,
+            c.enrolled_at,
+            c.status,
+            :now_ts             AS start_date,
+            '9999-12-31'::DATE  AS end_date,
+            :src_main           AS source_id,
+            :batch              AS insert_id,
+            NULL                AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+    report.append("   • inserted new and re‐versioned changed warehouse.enrollments\n")
+
+
+def scd2_sales(conn, batch_id, now_ts, report):
+    """
+    SCD2 step for warehouse.sales. Needs enrollments and sales_managers to be current.
+    """
     #  1.5) SALES (unchanged)
-    with warehouse_engine.begin() as conn:
-        #  1.5.a) Insert brand-new sales
-        conn.execute(text("""
-            INSERT INTO warehouse.sales (
-                sale_id, enrollment_sk, sales_manager_sk, sale_date, cost_in_rubbles,
-                start_date, end_date, source_id, insert_id, update_id
-            )
+    #  Insert brand‐new sales, close out changed ones and insert their new versions in one statement:
+    #  the change‐set (new rows have no old_sk) is materialized once and drives both the UPDATE and the INSERT
+    conn.execute(text("""
+        WITH changed AS MATERIALIZED (
             SELECT
+                w.sale_sk           AS old_sk,
                 s.sale_id,
                 e.enrollment_sk,
                 m.sales_manager_sk,
                 s.sale_date,
-                s.cost_in_rubbles,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
+                s.cost_in_rubbles
             FROM source.sales AS s
-            JOIN warehouse.enrollments AS e
-              ON s.enrollment_id = e.enrollment_id
-             AND e.end_date = '9999-12-31'::DATE
-            JOIN warehouse.sales_managers AS m
-              ON s.manager_id = m.manager_id
-             AND m.end_date = '9999-12-31'::DATE
             LEFT JOIN warehouse.sales AS w
-              ON s.sale_id = w.sale_id
-                 AND w.end_date = '9999-12-31'::DATE
-            WHERE w.sale_id IS NULL;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new warehouse.sales")
-
-    with warehouse_engine.begin() as conn:
-        #  1.5.b) Insert new versions for changed sales
-        conn.execute(text("""
-            INSERT INTO warehouse.sales (
-                sale_id, enrollment_sk, sales_manager_sk, sale_date, cost_in_rubbles,
-                start_date, end_date, source_id, insert_id, update_id
-            )
-            SELECT
-                s.sale_id,
-                e.enrollment_sk,
-                m.sales_manager_sk,
-                s.sale_date,
-                s.cost_in_rubbles,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id,
-                :batch              AS insert_id,
-                NULL                AS update_id
-            FROM source.sales AS s
-            JOIN warehouse.sales AS w
               ON s.sale_id = w.sale_id
              AND w.end_date = '9999-12-31'::DATE
             JOIN warehouse.enrollments AS e
@@ -919,147 +898,120 @@ def run_incremental_load(batch_id: int):
             JOIN warehouse.sales_managers AS m
               ON s.manager_id = m.manager_id
              AND m.end_date = '9999-12-31'::DATE
-            WHERE 
-                  s.enrollment_id   IS DISTINCT FROM (
-                    SELECT x.enrollment_id 
-                    FROM warehouse.enrollments x 
-                    WHERE x.enrollment_sk = w.enrollment_sk
-                  )
-              OR  s.manager_id      IS DISTINCT FROM (
-                    SELECT y.manager_id 
-                    FROM warehouse.sales_managers y 
-                    WHERE y.sales_manager_sk = w.sales_manager_sk
-                  )
-              OR  s.sale_date       IS DISTINCT FROM w.sale_date
-              OR  s.cost_in_rubbles IS DISTINCT FROM w.cost_in_rubbles;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new versions for changed warehouse.sales")
-
-    with warehouse_engine.begin() as conn:
-        #  1.5.c) Close out old active sales
-        conn.execute(text("""
+            LEFT JOIN warehouse.enrollments AS we
+              ON we.enrollment_sk = w.enrollment_sk
+            LEFT JOIN warehouse.sales_managers AS wm
+              ON wm.sales_manager_sk = w.sales_manager_sk
+            WHERE w.sale_sk IS NULL
+               OR (s.enrollment_id, s.manager_id, s.sale_date, s.cost_in_rubbles)
+                  IS DISTINCT FROM
+                  (we.enrollment_id, wm.manager_id, w.sale_date, w.cost_in_rubbles)
+        ),
+        closed AS (
             UPDATE warehouse.sales AS w
-               SET end_date  = NOW(),
+               SET end_date  = :now_ts,
                    update_id = :batch
-            FROM source.sales AS s
-            JOIN warehouse.enrollments AS e
-              ON s.enrollment_id = e.enrollment_id
-             AND e.end_date = '9999-12-31'::DATE
-            JOIN warehouse.sales_managers AS m
-              ON s.manager_id = m.manager_id
-             AND m.end_date = '9999-12-31'::DATE
-            WHERE w.sale_id = s.sale_id
-              AND w.end_date = '9999-12-31'::DATE
-              AND (
-                    s.enrollment_id   IS DISTINCT FROM (
-                      SELECT x.enrollment_id 
-                      FROM warehouse.enrollments x 
-                      WHERE x.enrollment_sk = w.enrollment_sk
-                    )
-                OR  s.manager_id      IS DISTINCT FROM (
-                      SELECT y.manager_id 
-                      FROM warehouse.sales_managers y 
-                      WHERE y.sales_manager_sk = w.sales_manager_sk
-                    )
-                OR  s.sale_date       IS DISTINCT FROM w.sale_date
-                OR  s.cost_in_rubbles IS DISTINCT FROM w.cost_in_rubbles
-              );
-        """), {"batch": batch_id})
-    print("   • closed out old versions of warehouse.sales\n")
-
+              FROM changed AS c
+             WHERE w.sale_sk = c.old_sk
+        )
+        INSERT INTO warehouse.sales (
+            sale_id, enrollment_sk, sales_manager_sk, sale_date, cost_in_rubbles,
+            start_date, end_date, source_id, insert_id, update_id
+        )
+        SELECT
+            c.sale_id,
+            c.enrollment_sk,
+            c.sales_manager_sk,
+            c.sale_date,
+            c.cost_in_rubbles,
+            :now_ts             AS start_date,
+            '9999-12-31'::DATE  AS end_date,
+            :src_main           AS source_id,
+            :batch              AS insert_id,
+            NULL                AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+    report.append("   • inserted new and re‐versioned changed warehouse.sales\n")
+
+
+def scd2_traffic_sources(conn, batch_id, now_ts, report):
+    """
+    SCD2 step for warehouse.traffic_sources.
+    """
     #  1.6) TRAFFIC_SOURCES (unchanged)
-    with warehouse_engine.begin() as conn:
-        #  1.6.a) Insert brand-new traffic_sources
-        conn.execute(text("""
-            INSERT INTO warehouse.traffic_sources (
-                source_id, name, channel, details,
-                start_date, end_date, source_id_audit, insert_id, update_id
-            )
+    #  Insert brand‐new traffic_sources, close out changed ones and insert their new versions in one statement:
+    #  the change‐set (new rows have no old_sk) is materialized once and drives both the UPDATE and the INSERT
+    conn.execute(text(f"""
+        WITH src AS (
             SELECT
                 s.source_id,
                 s.name,
                 s.channel,
                 s.details,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id_audit,
-                :batch              AS insert_id,
-                NULL                AS update_id
+                {TRAFFIC_SOURCE_ROW_HASH_SQL.format(t="s")} AS row_hash
             FROM source.traffic_sources AS s
-            LEFT JOIN warehouse.traffic_sources AS w
-              ON s.source_id = w.source_id
-                 AND w.end_date = '9999-12-31'::DATE
-            WHERE w.source_id IS NULL;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new warehouse.traffic_sources")
-
-    with warehouse_engine.begin() as conn:
-        #  1.6.b) Insert new versions for changed traffic_sources
-        conn.execute(text("""
-            INSERT INTO warehouse.traffic_sources (
-                source_id, name, channel, details,
-                start_date, end_date, source_id_audit, insert_id, update_id
-            )
+        ),
+        changed AS MATERIALIZED (
             SELECT
+                w.traffic_source_sk AS old_sk,
                 s.source_id,
                 s.name,
                 s.channel,
                 s.details,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id_audit,
-                :batch              AS insert_id,
-                NULL                AS update_id
-            FROM source.traffic_sources AS s
-            JOIN warehouse.traffic_sources AS w
+                s.row_hash
+            FROM src AS s
+            LEFT JOIN warehouse.traffic_sources AS w
               ON s.source_id = w.source_id
              AND w.end_date = '9999-12-31'::DATE
-            WHERE 
-                  s.name    IS DISTINCT FROM w.name
-              OR  s.channel IS DISTINCT FROM w.channel
-              OR  COALESCE(s.details, '') IS DISTINCT FROM COALESCE(w.details, '');
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new versions for changed warehouse.traffic_sources")
-
-    with warehouse_engine.begin() as conn:
-        #  1.6.c) Close out old active traffic_sources
-        conn.execute(text("""
+            WHERE w.traffic_source_sk IS NULL
+               OR s.row_hash IS DISTINCT FROM w.row_hash
+        ),
+        closed AS (
             UPDATE warehouse.traffic_sources AS w
-               SET end_date     = NOW(),
-                   update_id    = :batch
-            FROM source.traffic_sources AS s
-            WHERE w.source_id = s.source_id
-              AND w.end_date = '9999-12-31'::DATE
-              AND (
-                    s.name    IS DISTINCT FROM w.name
-                OR  s.channel IS DISTINCT FROM w.channel
-                OR  COALESCE(s.details, '') IS DISTINCT FROM COALESCE(w.details, '')
-              );
-        """), {"batch": batch_id})
-    print("   • closed out old versions of warehouse.traffic_sources\n")
-
+               SET end_date  = :now_ts,
+                   update_id = :batch
+              FROM changed AS c
+             WHERE w.traffic_source_sk = c.old_sk
+        )
+        INSERT INTO warehouse.traffic_sources (
+            source_id, name, channel, details, row_hash,
+            start_date, end_date, source_id_audit, insert_id, update_id
+        )
+        SELECT
+            c.source_id,
+            c.name,
+            c.channel,
+            c.details,
+            c.row_hash,
+            :now_ts             AS start_date,
+            '9999-12-31'::DATE  AS end_date,
+            :src_main           AS source_id_audit,
+            :batch              AS insert_id,
+            NULL                AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+    report.append("   • inserted new and re‐versioned changed warehouse.traffic_sources\n")
+
+
+def scd2_user_traffic(conn, batch_id, now_ts, report):
+    """
+    SCD2 step for warehouse.user_traffic from source.user_traffic and the CSV.
+    Needs users and traffic_sources to be current.
+    """
     # ───────────────────────────────────────────────────────────────────────────────
     #  1.7) USER_TRAFFIC
     # ───────────────────────────────────────────────────────────────────────────────
 
-    #  1.7.a) Insert brand-new “source.user_traffic” rows → warehouse.user_traffic
-    #          (SCD2, source_id_audit = 1)
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            INSERT INTO warehouse.user_traffic (
-                user_sk, traffic_source_sk, referred_at, campaign_code,
-                start_date, end_date, source_id_audit, insert_id, update_id
-            )
+    #  Insert brand‐new user_traffic, close out changed ones and insert their new versions in one statement:
+    #  the change‐set (new rows have no old_sk) is materialized once and drives both the UPDATE and the INSERT
+    conn.execute(text("""
+        WITH changed AS MATERIALIZED (
             SELECT
+                w.user_traffic_sk   AS old_sk,
                 u.user_sk,
                 t.traffic_source_sk,
                 s.referred_at,
-                s.campaign_code,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id_audit,
-                :batch              AS insert_id,
-                NULL                AS update_id
+                s.campaign_code
             FROM source.user_traffic AS s
             JOIN warehouse.users AS u
               ON s.user_id = u.user_id
@@ -1068,65 +1020,37 @@ def run_incremental_load(batch_id: int):
               ON s.source_id = t.source_id
              AND t.end_date = '9999-12-31'::DATE
             LEFT JOIN warehouse.user_traffic AS w
-              ON u.user_sk = w.user_sk
-             AND t.traffic_source_sk = w.traffic_source_sk
-             AND s.referred_at = w.referred_at
-             AND w.end_date = '9999-12-31'::DATE
-            WHERE w.user_traffic_sk IS NULL;
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new warehouse.user_traffic from source.user_traffic (source_id_audit=1)")
-
-    with warehouse_engine.begin() as conn:
-        #  1.7.b) Insert new versions for changed “source.user_traffic” (campaign_code changed)
-        conn.execute(text("""
-            INSERT INTO warehouse.user_traffic (
-                user_sk, traffic_source_sk, referred_at, campaign_code,
-                start_date, end_date, source_id_audit, insert_id, update_id
-            )
-            SELECT
-                u.user_sk,
-                t.traffic_source_sk,
-                s.referred_at,
-                s.campaign_code,
-                NOW()               AS start_date,
-                '9999-12-31'::DATE  AS end_date,
-                :src_main           AS source_id_audit,
-                :batch              AS insert_id,
-                NULL                AS update_id
-            FROM source.user_traffic AS s
-            JOIN warehouse.user_traffic AS w
-              ON s.referred_at = w.referred_at
+              ON w.user_sk = u.user_sk
+             AND w.traffic_source_sk = t.traffic_source_sk
+             AND w.referred_at = s.referred_at
              AND w.end_date = '9999-12-31'::DATE
-            JOIN warehouse.users AS u
-              ON s.user_id = u.user_id
-             AND u.end_date = '9999-12-31'::DATE
-            JOIN warehouse.traffic_sources AS t
-              ON s.source_id = t.source_id
-             AND t.end_date = '9999-12-31'::DATE
-            WHERE COALESCE(s.campaign_code, '') <> COALESCE(w.campaign_code, '');
-        """), {"src_main": SRC_MAIN, "batch": batch_id})
-    print("   • inserted new versions for changed warehouse.user_traffic from source (source_id_audit=1)")
-
-    with warehouse_engine.begin() as conn:
-        #  1.7.c) Close out old active “source.user_traffic” rows (campaign_code changed)
-        conn.execute(text("""
+            WHERE w.user_traffic_sk IS NULL
+               OR s.campaign_code IS DISTINCT FROM w.campaign_code
+        ),
+        closed AS (
             UPDATE warehouse.user_traffic AS w
-               SET end_date     = NOW(),
-                   update_id    = :batch
-            FROM source.user_traffic AS s
-            JOIN warehouse.users AS u
-              ON s.user_id = u.user_id
-             AND u.end_date = '9999-12-31'::DATE
-            JOIN warehouse.traffic_sources AS t
-              ON s.source_id = t.source_id
-             AND t.end_date = '9999-12-31'::DATE
-            WHERE w.user_sk = u.user_sk
-              AND w.traffic_source_sk = t.traffic_source_sk
-              AND w.referred_at = s.referred_at
-              AND w.end_date   = '9999-12-31'::DATE
-              AND COALESCE(s.campaign_code, '') <> COALESCE(w.campaign_code, '');
-        """), {"batch": batch_id})
-    print("   • closed out old versions of warehouse.user_traffic from source (source_id_audit=1)\n")
+               SET end_date  = :now_ts,
+                   update_id = :batch
+              FROM changed AS c
+             WHERE w.user_traffic_sk = c.old_sk
+        )
+        INSERT INTO warehouse.user_traffic (
+            user_sk, traffic_source_sk, referred_at, campaign_code,
+            start_date, end_date, source_id_audit, insert_id, update_id
+        )
+        SELECT
+            c.user_sk,
+            c.traffic_source_sk,
+            c.referred_at,
+            c.campaign_code,
+            :now_ts             AS start_date,
+            '9999-12-31'::DATE  AS end_date,
+            :src_main           AS source_id_audit,
+            :batch              AS insert_id,
+            NULL                AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "src_main": SRC_MAIN, "batch": batch_id})
+    report.append("   • inserted new and re‐versioned changed warehouse.user_traffic\n")
 
     # ───────────────────────────────────────────────────────────────────────────────
     #  1.7.1) CSV “user_traffic.csv” → warehouse.user_traffic (source_id_audit = 2)
@@ -1139,183 +1063,158 @@ def run_incremental_load(batch_id: int):
     #   (b) For existing CSV rows whose campaign_code changed, “close” the old version,
     #       then insert a brand‐new version with source_id_audit = 2.
     #
-    # We read the CSV fully and do two passes: new rows & changed rows.
+    # The CSV is COPY'd into staging.user_traffic_csv once, then the set‐based
+    # statement below mirrors 1.7 with the staged rows in place of source.user_traffic.
     #
-    csv_rows = list(csv.DictReader(open(CSV_PATH, newline="")))
-
-    # (1.a) INSERT brand‐new CSV rows that don't exist yet:
-    #       We look up for each CSV row: "warehouse.user_traffic" match on (user_sk, traffic_source_sk, referred_at, end_date='9999-12-31').
-    #       If not found, we insert it as a new SCD2 row (start_date=NOW(), end_date='9999-12-31', source_id_audit=2).
-    new_inserts = []
-    for r in csv_rows:
-        # Check existence in active warehouse.user_traffic
-        with warehouse_engine.begin() as conn:
-            found = conn.execute(text("""
-                SELECT 1
-                  FROM warehouse.user_traffic AS w
-                  JOIN warehouse.users         AS u ON u.user_sk = w.user_sk
-                  JOIN warehouse.traffic_sources AS t ON t.traffic_source_sk = w.traffic_source_sk
-                 WHERE u.user_id = :user_id
-                   AND t.source_id = :source_id
-                   AND w.referred_at = CAST(:referred_at AS TIMESTAMP)
-                   AND w.end_date = '9999-12-31'::DATE
-               LIMIT 1;
-            """), {
-                "user_id"     : r["user_id"],
-                "source_id"   : r["source_id"],
-                "referred_at" : r["referred_at"],
-            }).first()
-
-        if not found:
-            # This CSV row doesn’t exist in the active slice → we’ll insert it fresh.
-            new_inserts.append(r)
-
-    if new_inserts:
-        with warehouse_engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO warehouse.user_traffic
-                  (user_sk, traffic_source_sk, referred_at, campaign_code,
-                   start_date, end_date, source_id_audit, insert_id, update_id)
-                SELECT
-                  u.user_sk,
-                  t.traffic_source_sk,
-                  CAST(:referred_at AS TIMESTAMP),
-                  :campaign_code,
-                  NOW()               AS start_date,
-                  '9999-12-31'::DATE  AS end_date,
-                  :csv_audit          AS source_id_audit,
-                  :batch              AS insert_id,
-                  NULL                AS update_id
-                FROM warehouse.users AS u
-                JOIN warehouse.traffic_sources AS t
-                  ON t.source_id = :source_id
-                 AND t.end_date = '9999-12-31'::DATE
-                WHERE u.user_id = :user_id
-                  AND u.end_date = '9999-12-31'::DATE;
-            """), [
-                {
-                    "user_id"      : r["user_id"],
-                    "source_id"    : r["source_id"],
-                    "referred_at"  : r["referred_at"],
-                    "campaign_code": r["campaign_code"],
-                    "csv_audit"    : SRC_CSV_AUDIT_ID,
-                    "batch"        : batch_id
-                }
-                for r in new_inserts
-            ])
-    print(f"   • inserted {len(new_inserts)} new CSV rows into warehouse.user_traffic (source_id_audit=2)")
-
-    # (1.b) Find any CSV rows whose campaign_code changed _relative to_ the currently‐active row:
-    #       If we see a row (user_id, source_id, referred_at) that _is_ in warehouse.user_traffic but its active version
-    #       has a different campaign_code, we “close out” the old version and insert a new one.
-    changed_inserts = []
-    for r in csv_rows:
-        # Look up the active warehouse.user_traffic for this combination:
-        row = None
-        with warehouse_engine.begin() as conn:
-            row = conn.execute(text("""
-                SELECT w.user_traffic_sk,
-                       w.campaign_code
-                  FROM warehouse.user_traffic AS w
-                  JOIN warehouse.users AS u ON u.user_sk = w.user_sk
-                  JOIN warehouse.traffic_sources AS t ON t.traffic_source_sk = w.traffic_source_sk
-                 WHERE u.user_id = :user_id
-                   AND t.source_id = :source_id
-                   AND w.referred_at = CAST(:referred_at AS TIMESTAMP)
-                   AND w.end_date = '9999-12-31'::DATE
-                 LIMIT 1;
-            """), {
-                "user_id"     : r["user_id"],
-                "source_id"   : r["source_id"],
-                "referred_at" : r["referred_at"],
-            }).mappings().first()
-
-        if row:
-            existing_campaign = row["campaign_code"] or ""
-            new_campaign      = r["campaign_code"] or ""
-            if new_campaign != existing_campaign:
-                # The campaign_code changed → close out the old version and insert a new one
-                changed_inserts.append(r)
-
-                # (i) Close out the old version:
-                with warehouse_engine.begin() as conn:
-                    conn.execute(text("""
-                        UPDATE warehouse.user_traffic AS w
-                           SET end_date   = NOW(),
-                               update_id  = :batch
-                        FROM warehouse.users AS u,
-                             warehouse.traffic_sources AS t
-                        WHERE u.user_id = :user_id
-                          AND t.source_id = :source_id
-                          AND w.user_sk = u.user_sk
-                          AND w.traffic_source_sk = t.traffic_source_sk
-                          AND w.referred_at = CAST(:referred_at AS TIMESTAMP)
-                          AND w.end_date = '9999-12-31'::DATE;
-                    """), {
-                        "user_id": r["user_id"],
-                        "source_id": r["source_id"],
-                        "referred_at": r["referred_at"],
-                        "batch": batch_id
-                    })
-
-    # (ii) Insert a fresh version for each “changed” CSV row:
-    if changed_inserts:
-        with warehouse_engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO warehouse.user_traffic
-                  (user_sk, traffic_source_sk, referred_at, campaign_code,
-                   start_date, end_date, source_id_audit, insert_id, update_id)
-                SELECT
-                  u.user_sk,
-                  t.traffic_source_sk,
-                  CAST(:referred_at AS TIMESTAMP),
-                  :campaign_code,
-                  NOW()               AS start_date,
-                  '9999-12-31'::DATE  AS end_date,
-                  :csv_audit          AS source_id_audit,
-                  :batch              AS insert_id,
-                  NULL                AS update_id
-                FROM warehouse.users AS u
-                JOIN warehouse.traffic_sources AS t
-                  ON t.source_id = :source_id
-                 AND t.end_date = '9999-12-31'::DATE
-                WHERE u.user_id = :user_id
-                  AND u.end_date = '9999-12-31'::DATE;
-            """), [
-                {
-                    "user_id"      : r["user_id"],
-                    "source_id"    : r["source_id"],
-                    "referred_at"  : r["referred_at"],
-                    "campaign_code": r["campaign_code"],
-                    "csv_audit"    : SRC_CSV_AUDIT_ID,
-                    "batch"        : batch_id
-                }
-                for r in changed_inserts
-            ])
-    print(f"   • closed out and re‐inserted {len(changed_inserts)} changed CSV rows into warehouse.user_traffic (source_id_audit=2)\n")
+    stage_user_traffic_csv(conn)
 
+    #  Insert brand‐new CSV rows, close out the ones whose campaign_code changed and insert their
+    #  new versions (new rows have no old_sk). '' and NULL campaign codes count as equal: rows
+    #  loaded before the CSV was COPY'd still carry '' where the file has an empty field.
+    csv_count = conn.execute(text("""
+        WITH changed AS MATERIALIZED (
+            SELECT
+                w.user_traffic_sk   AS old_sk,
+                u.user_sk,
+                t.traffic_source_sk,
+                s.referred_at,
+                s.campaign_code
+            FROM staging.user_traffic_csv AS s
+            JOIN warehouse.users AS u
+              ON s.user_id = u.user_id
+             AND u.end_date = '9999-12-31'::DATE
+            JOIN warehouse.traffic_sources AS t
+              ON s.source_id = t.source_id
+             AND t.end_date = '9999-12-31'::DATE
+            LEFT JOIN warehouse.user_traffic AS w
+              ON w.user_sk = u.user_sk
+             AND w.traffic_source_sk = t.traffic_source_sk
+             AND w.referred_at = s.referred_at
+             AND w.end_date = '9999-12-31'::DATE
+            WHERE w.user_traffic_sk IS NULL
+               OR NULLIF(s.campaign_code, '') IS DISTINCT FROM NULLIF(w.campaign_code, '')
+        ),
+        closed AS (
+            UPDATE warehouse.user_traffic AS w
+               SET end_date  = :now_ts,
+                   update_id = :batch
+              FROM changed AS c
+             WHERE w.user_traffic_sk = c.old_sk
+        )
+        INSERT INTO warehouse.user_traffic (
+            user_sk, traffic_source_sk, referred_at, campaign_code,
+            start_date, end_date, source_id_audit, insert_id, update_id
+        )
+        SELECT
+            c.user_sk,
+            c.traffic_source_sk,
+            c.referred_at,
+            c.campaign_code,
+            :now_ts             AS start_date,
+            '9999-12-31'::DATE  AS end_date,
+            :csv_audit          AS source_id_audit,
+            :batch              AS insert_id,
+            NULL                AS update_id
+        FROM changed AS c;
+    """), {"now_ts": now_ts, "csv_audit": SRC_CSV_AUDIT_ID, "batch": batch_id}).rowcount
+    report.append(f"   • inserted {csv_count} new or re‐versioned CSV rows into warehouse.user_traffic (source_id_audit=2)\n")
+
+
+# Incremental SCD2 steps, parents before the children that read their active rows
+SCD2_STEPS = [
+    scd2_users,
+    scd2_sales_managers,
+    scd2_courses,
+    scd2_traffic_sources,
+    scd2_enrollments,
+    scd2_sales,
+    scd2_user_traffic,
+]
+
+
+def run_scd2_steps(conn, batch_id, now_ts, report):
+    """
+    Run every SCD2_STEPS entry in order on the caller's connection and transaction.
+    """
+    for step in SCD2_STEPS:
+        step(conn, batch_id, now_ts, report)
 
-    # ───────────────────────────────────────────────────────────────────────────────
-    #  2) Refresh “star_schema” dims & fact
-    # ───────────────────────────────────────────────────────────────────────────────
 
-    #  2.0) DELETE existing fact_sales (FK constraints require this first)
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("DELETE FROM star_schema.fact_sales;"))
-    print("   • cleared star_schema.fact_sales")
+def run_incremental_load(batch_id: int):
+    now_ts = datetime.datetime.now(pytz.UTC)
+    print(f"[{now_ts}] ▶️  Starting INCREMENTAL load (batch_id={batch_id})\n")
 
-    #  2.1) dim_user – delete + re‐insert changed keys (explicit SK)
+    # The whole incremental load is ONE transaction: a failure in any step (SCD2 or star refresh)
+    # rolls everything back, so a batch_id is never left half‐applied (the star refresh selects
+    # rows by insert_id / update_id = batch_id) and a re‐run starts from a clean slate.
+    # Status lines are collected and printed only after COMMIT, so the log never reports
+    # a step whose transaction was later rolled back.
+    report = []
     with warehouse_engine.begin() as conn:
+        tune_bulk_transaction(conn)
+
+        # ───────────────────────────────────────────────────────────────────────────────
+        #  1) Incrementally update “warehouse” schema with SCD2 logic
+        # ───────────────────────────────────────────────────────────────────────────────
+        run_scd2_steps(conn, batch_id, now_ts, report)
+
+        # ───────────────────────────────────────────────────────────────────────────────
+        #  2) Refresh “star_schema” dims & fact from the rows section 1 just wrote
+        # ───────────────────────────────────────────────────────────────────────────────
+
+        # Section 1 just rewrote the batch slice; refresh statistics so the insert_id/update_id
+        # lookups below are planned against this batch's row counts, not pre‐load estimates.
         conn.execute(text("""
-            DELETE FROM star_schema.dim_user 
-            WHERE user_key IN (
-                SELECT u.user_sk 
-                FROM warehouse.users u
-                WHERE u.insert_id = :batch OR u.update_id = :batch
-            );
-        """), {"batch": batch_id})
+            ANALYZE warehouse.users, warehouse.sales_managers, warehouse.courses, warehouse.enrollments,
+                    warehouse.sales, warehouse.traffic_sources, warehouse.user_traffic;
+        """))
+
+        # Dim keys closed in this batch, reused by the fact cleanup (2.0) and the dim refreshes (2.1–2.4)
+        closed = {
+            "user_keys":           closed_keys(conn, "users",           "user_sk",           batch_id),
+            "course_keys":         closed_keys(conn, "courses",         "course_sk",         batch_id),
+            "sales_manager_keys":  closed_keys(conn, "sales_managers",  "sales_manager_sk",  batch_id),
+            "traffic_source_keys": closed_keys(conn, "traffic_sources", "traffic_source_sk", batch_id),
+        }
+
+        #  2.0) Drop only the fact rows this batch invalidates: re‐versioned sales, sales whose
+        #       enrollment was closed, users whose latest referral may have moved, and every row that
+        #       points at a dim key closed in this batch (FK constraints require this before the dims
+        #       below lose those keys). 2.6 then re‐adds whatever active sale is missing from the fact,
+        #       resolving every dim key to the active version of its natural id.
+        removed = conn.execute(text("""
+            DELETE FROM star_schema.fact_sales AS f
+            WHERE f.sale_id IN (
+                    SELECT s.sale_id FROM warehouse.sales AS s WHERE s.update_id = :batch
+                  )
+               OR f.sale_id IN (
+                    SELECT s.sale_id
+                      FROM warehouse.sales AS s
+                      JOIN warehouse.enrollments AS e ON e.enrollment_sk = s.enrollment_sk
+                     WHERE e.update_id = :batch
+                  )
+               OR f.user_key IN (
+                    SELECT ut.user_sk FROM warehouse.user_traffic AS ut WHERE ut.insert_id = :batch
+                    UNION ALL
+                    SELECT ut.user_sk FROM warehouse.user_traffic AS ut WHERE ut.update_id = :batch
+                  )
+               OR f.user_key           = ANY(CAST(:user_keys AS INTEGER[]))
+               OR f.course_key         = ANY(CAST(:course_keys AS INTEGER[]))
+               OR f.sales_manager_key  = ANY(CAST(:sales_manager_keys AS INTEGER[]))
+               OR f.traffic_source_key = ANY(CAST(:traffic_source_keys AS INTEGER[]));
+        """), {"batch": batch_id, **closed}).rowcount
+        report.append(f"   • removed {removed} stale star_schema.fact_sales rows")
+
+        #  2.1) dim_user – drop keys closed in this batch, upsert the batch's active keys (explicit SK)
+        #       Active rows never carry update_id (closing a version sets end_date and update_id together),
+        #       so “this batch's active keys” is just insert_id = :batch – a single ix_<t>_insert_id probe.
+        if closed["user_keys"]:
+            conn.execute(text("""
+                DELETE FROM star_schema.dim_user
+                WHERE user_key = ANY(:keys);
+            """), {"keys": closed["user_keys"]})
         conn.execute(text("""
-            INSERT INTO star_schema.dim_user
+            INSERT INTO star_schema.dim_user AS d
               (user_key, user_id, first_name, last_name, email, signup_date, country)
             SELECT
               u.user_sk    AS user_key,
@@ -1327,11 +1226,21 @@ def run_incremental_load(batch_id: int):
               u.country
             FROM warehouse.users u
             WHERE u.end_date = '9999-12-31'::DATE
-              AND (u.insert_id = :batch OR u.update_id = :batch);
+              AND u.insert_id = :batch
+            ON CONFLICT (user_key) DO UPDATE
+               SET user_id     = EXCLUDED.user_id,
+                   first_name  = EXCLUDED.first_name,
+                   last_name   = EXCLUDED.last_name,
+                   email       = EXCLUDED.email,
+                   signup_date = EXCLUDED.signup_date,
+                   country     = EXCLUDED.country
+             WHERE (d.user_id, d.first_name, d.last_name, d.email, d.signup_date, d.country)
+                   IS DISTINCT FROM
+                   (EXCLUDED.user_id, EXCLUDED.first_name, EXCLUDED.last_name,
+                    EXCLUDED.email, EXCLUDED.signup_date, EXCLUDED.country);
         """), {"batch": batch_id})
-    print("   • updated star_schema.dim_user")
+        report.append("   • updated star_schema.dim_user")
 
-    with warehouse_engine.begin() as conn:
         conn.execute(text("""
             INSERT INTO star_schema.dim_user
               (user_key, user_id, first_name, last_name, email, signup_date, country)
@@ -1344,25 +1253,23 @@ def run_incremental_load(batch_id: int):
               u.registered_at::DATE,
               u.country
             FROM warehouse.users AS u
-            LEFT JOIN star_schema.dim_user AS d
-              ON d.user_key = u.user_sk
             WHERE u.end_date = '9999-12-31'::DATE
-              AND d.user_key IS NULL;
+              AND NOT EXISTS (
+                  SELECT 1
+                    FROM star_schema.dim_user AS d
+                   WHERE d.user_key = u.user_sk
+              );
         """))
-    print("   • inserted any missing star_schema.dim_user entries")
+        report.append("   • inserted any missing star_schema.dim_user entries")
 
-    #  2.2) dim_course – delete + re‐insert changed keys (explicit SK)
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            DELETE FROM star_schema.dim_course
-            WHERE course_key IN (
-                SELECT c.course_sk 
-                FROM warehouse.courses c
-                WHERE c.insert_id = :batch OR c.update_id = :batch
-            );
-        """), {"batch": batch_id})
+        #  2.2) dim_course – drop keys closed in this batch, upsert the batch's active keys (explicit SK)
+        if closed["course_keys"]:
+            conn.execute(text("""
+                DELETE FROM star_schema.dim_course
+                WHERE course_key = ANY(:keys);
+            """), {"keys": closed["course_keys"]})
         conn.execute(text("""
-            INSERT INTO star_schema.dim_course
+            INSERT INTO star_schema.dim_course AS d
               (course_key, course_id, title, subject, price_in_rubbles, category, sub_category)
             SELECT
               c.course_sk    AS course_key,
@@ -1374,22 +1281,29 @@ def run_incremental_load(batch_id: int):
               c.sub_category
             FROM warehouse.courses c
             WHERE c.end_date = '9999-12-31'::DATE
-              AND (c.insert_id = :batch OR c.update_id = :batch);
+              AND c.insert_id = :batch
+            ON CONFLICT (course_key) DO UPDATE
+               SET course_id        = EXCLUDED.course_id,
+                   title            = EXCLUDED.title,
+                   subject          = EXCLUDED.subject,
+                   price_in_rubbles = EXCLUDED.price_in_rubbles,
+                   category         = EXCLUDED.category,
+                   sub_category     = EXCLUDED.sub_category
+             WHERE (d.course_id, d.title, d.subject, d.price_in_rubbles, d.category, d.sub_category)
+                   IS DISTINCT FROM
+                   (EXCLUDED.course_id, EXCLUDED.title, EXCLUDED.subject,
+                    EXCLUDED.price_in_rubbles, EXCLUDED.category, EXCLUDED.sub_category);
         """), {"batch": batch_id})
-    print("   • updated star_schema.dim_course")
+        report.append("   • updated star_schema.dim_course")
 
-    #  2.3) dim_traffic_source – delete + re‐insert changed keys (explicit SK)
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
-            DELETE FROM star_schema.dim_traffic_source
-            WHERE traffic_source_key IN (
-                SELECT t.traffic_source_sk 
-                FROM warehouse.traffic_sources t
-                WHERE t.insert_id = :batch OR t.update_id = :batch
-            );
-        """), {"batch": batch_id})
+        #  2.3) dim_traffic_source – drop keys closed in this batch, upsert the batch's active keys (explicit SK)
+        if closed["traffic_source_keys"]:
+            conn.execute(text("""
+                DELETE FROM star_schema.dim_traffic_source
+                WHERE traffic_source_key = ANY(:keys);
+            """), {"keys": closed["traffic_source_keys"]})
         conn.execute(text("""
-            INSERT INTO star_schema.dim_traffic_source
+            INSERT INTO star_schema.dim_traffic_source AS d
               (traffic_source_key, traffic_source_id, name, channel)
             SELECT
               t.traffic_source_sk    AS traffic_source_key,
@@ -1398,11 +1312,17 @@ def run_incremental_load(batch_id: int):
               t.channel
             FROM warehouse.traffic_sources t
             WHERE t.end_date = '9999-12-31'::DATE
-              AND (t.insert_id = :batch OR t.update_id = :batch);
+              AND t.insert_id = :batch
+            ON CONFLICT (traffic_source_key) DO UPDATE
+               SET traffic_source_id = EXCLUDED.traffic_source_id,
+                   name              = EXCLUDED.name,
+                   channel           = EXCLUDED.channel
+             WHERE (d.traffic_source_id, d.name, d.channel)
+                   IS DISTINCT FROM
+                   (EXCLUDED.traffic_source_id, EXCLUDED.name, EXCLUDED.channel);
         """), {"batch": batch_id})
-    print("   • updated star_schema.dim_traffic_source")
+        report.append("   • updated star_schema.dim_traffic_source")
 
-    with warehouse_engine.begin() as conn:
         conn.execute(text("""
             INSERT INTO star_schema.dim_traffic_source
               (traffic_source_key, traffic_source_id, name, channel)
@@ -1412,25 +1332,31 @@ def run_incremental_load(batch_id: int):
               t.name,
               t.channel
             FROM warehouse.traffic_sources AS t
-            LEFT JOIN star_schema.dim_traffic_source AS d
-              ON d.traffic_source_key = t.traffic_source_sk
             WHERE t.end_date = '9999-12-31'::DATE
-              AND d.traffic_source_key IS NULL;
+              AND NOT EXISTS (
+                  SELECT 1
+                    FROM star_schema.dim_traffic_source AS d
+                   WHERE d.traffic_source_key = t.traffic_source_sk
+              );
         """))
-    print("   • inserted any missing star_schema.dim_traffic_source entries")
+        report.append("   • inserted any missing star_schema.dim_traffic_source entries")
 
-    #  2.4) dim_sales_manager – delete + re‐insert changed keys (explicit SK)
-    with warehouse_engine.begin() as conn:
+        # Sentinel row for sales whose user has no active referral (2.6 uses COALESCE(..., -1))
         conn.execute(text("""
-            DELETE FROM star_schema.dim_sales_manager
-            WHERE sales_manager_key IN (
-                SELECT m.sales_manager_sk 
-                FROM warehouse.sales_managers m
-                WHERE m.insert_id = :batch OR m.update_id = :batch
-            );
-        """), {"batch": batch_id})
+            INSERT INTO star_schema.dim_traffic_source
+              (traffic_source_key, traffic_source_id, name, channel)
+            VALUES (-1, -1, 'unknown', 'unknown')
+            ON CONFLICT (traffic_source_key) DO NOTHING;
+        """))
+
+        #  2.4) dim_sales_manager – drop keys closed in this batch, upsert the batch's active keys (explicit SK)
+        if closed["sales_manager_keys"]:
+            conn.execute(text("""
+                DELETE FROM star_schema.dim_sales_manager
+                WHERE sales_manager_key = ANY(:keys);
+            """), {"keys": closed["sales_manager_keys"]})
         conn.execute(text("""
-            INSERT INTO star_schema.dim_sales_manager
+            INSERT INTO star_schema.dim_sales_manager AS d
               (sales_manager_key, manager_id, first_name, last_name, email, hired_at)
             SELECT
               m.sales_manager_sk    AS sales_manager_key,
@@ -1441,86 +1367,77 @@ def run_incremental_load(batch_id: int):
               m.hired_at::DATE
             FROM warehouse.sales_managers m
             WHERE m.end_date = '9999-12-31'::DATE
-              AND (m.insert_id = :batch OR m.update_id = :batch);
+              AND m.insert_id = :batch
+            ON CONFLICT (sales_manager_key) DO UPDATE
+               SET manager_id = EXCLUDED.manager_id,
+                   first_name = EXCLUDED.first_name,
+                   last_name  = EXCLUDED.last_name,
+                   email      = EXCLUDED.email,
+                   hired_at   = EXCLUDED.hired_at
+             WHERE (d.manager_id, d.first_name, d.last_name, d.email, d.hired_at)
+                   IS DISTINCT FROM
+                   (EXCLUDED.manager_id, EXCLUDED.first_name, EXCLUDED.last_name,
+                    EXCLUDED.email, EXCLUDED.hired_at);
         """), {"batch": batch_id})
-    print("   • updated star_schema.dim_sales_manager")
+        report.append("   • updated star_schema.dim_sales_manager")
 
-    #  2.5) dim_date – only if new sales dates fall outside existing range (UNCHANGED)
-    with warehouse_engine.begin() as conn:
-        sale_row = conn.execute(text("""
-            SELECT 
-                MIN(s.sale_date)::DATE AS min_sale_date,
-                MAX(s.sale_date)::DATE AS max_sale_date
-            FROM warehouse.sales s
-            WHERE s.insert_id = :batch
-              AND s.end_date = '9999-12-31'::DATE;
+        #  2.5) dim_date – append only the days missing before/after the existing range
+        # New sales' date span and the current dim_date span in one round trip
+        drange = conn.execute(text("""
+            SELECT
+              (SELECT MIN(s.sale_date_d) FROM warehouse.sales AS s
+                WHERE s.insert_id = :batch AND s.end_date = '9999-12-31'::DATE) AS min_sale_date,
+              (SELECT MAX(s.sale_date_d) FROM warehouse.sales AS s
+                WHERE s.insert_id = :batch AND s.end_date = '9999-12-31'::DATE) AS max_sale_date,
+              (SELECT MIN(d.date) FROM star_schema.dim_date AS d)              AS min_date,
+              (SELECT MAX(d.date) FROM star_schema.dim_date AS d)              AS max_date;
         """), {"batch": batch_id}).mappings().one()
 
-    min_sale_date = sale_row["min_sale_date"]
-    max_sale_date = sale_row["max_sale_date"]
-
-    if not min_sale_date or not max_sale_date:
-        print("   • no new sales dates found; skipped dim_date update")
-    else:
-        with warehouse_engine.begin() as conn:
-            drange = conn.execute(text("""
-                SELECT MIN(date) AS min_date, MAX(date) AS max_date
-                FROM star_schema.dim_date;
-            """)).mappings().one()
-
+        min_sale_date = drange["min_sale_date"]
+        max_sale_date = drange["max_sale_date"]
         current_min = drange["min_date"]
         current_max = drange["max_date"]
 
-        needs_rebuild = False
-        if (current_min is None) or (min_sale_date < current_min) or (max_sale_date > current_max):
-            needs_rebuild = True
-
-        if needs_rebuild:
-            candidates_min = [d for d in [min_sale_date, current_min] if d is not None]
-            candidates_max = [d for d in [max_sale_date, current_max] if d is not None]
-            new_min = min(candidates_min) if candidates_min else datetime.date.today()
-            new_max = max(candidates_max) if candidates_max else datetime.date.today()
-
-            with warehouse_engine.begin() as conn:
-                conn.execute(text("DELETE FROM star_schema.dim_date;"))
-                conn.execute(text(f"""
-                    INSERT INTO star_schema.dim_date
-                      (date_key, date, year, quarter, month, day, weekday)
-                    SELECT
-                      TO_CHAR(gs::DATE, 'YYYYMMDD')::INT AS date_key,
-                      gs::DATE                         AS date,
-                      EXTRACT(YEAR   FROM gs)::INT     AS year,
-                      EXTRACT(QUARTER FROM gs)::INT     AS quarter,
-                      EXTRACT(MONTH  FROM gs)::INT     AS month,
-                      EXTRACT(DAY    FROM gs)::INT     AS day,
-                      EXTRACT(DOW    FROM gs)::INT     AS weekday
-                    FROM generate_series(
-                      '{new_min}'::DATE,
-                      '{new_max}'::DATE,
-                      '1 day'::INTERVAL
-                    ) AS gs;
-                """))
-            day_count = (new_max - new_min).days + 1
-            print(f"   • extended star_schema.dim_date ({day_count} days from {new_min} to {new_max})")
+        if not min_sale_date or not max_sale_date:
+            report.append("   • no new sales dates found; skipped dim_date update")
         else:
-            print("   • no date range extension needed for star_schema.dim_date")
-
-    #  2.6) fact_sales – Rebuild entire fact from all “active” warehouse.sales rows
-    # ─────────────────────────────────────────────────────────────────────────────────────────
-    #  2.6) fact_sales – Rebuild entire fact from all “active” warehouse.sales rows
-    #      (use the same DISTINCT ON subquery for user_traffic as in full load)
-    # ─────────────────────────────────────────────────────────────────────────────────────────
-
-    with warehouse_engine.begin() as conn:
-        conn.execute(text("""
+            gaps = []
+            if current_min is None:
+                gaps.append((min_sale_date, max_sale_date))
+            else:
+                if min_sale_date < current_min:
+                    gaps.append((min_sale_date, current_min - datetime.timedelta(days=1)))
+                if max_sale_date > current_max:
+                    gaps.append((current_max + datetime.timedelta(days=1), max_sale_date))
+
+            if gaps:
+                # Only the missing prefix/suffix is written; existing dim_date rows stay untouched
+                for gap_lo, gap_hi in gaps:
+                    day_count = copy_dim_date(conn, gap_lo, gap_hi)
+                    report.append(f"   • extended star_schema.dim_date ({day_count} days from {gap_lo} to {gap_hi})")
+            else:
+                report.append("   • no date range extension needed for star_schema.dim_date")
+
+        # ─────────────────────────────────────────────────────────────────────────────────────────
+        #  2.6) fact_sales – Insert every “active” warehouse.sales row that has no fact row: new
+        #      sales plus the ones 2.0 removed. Enrollments and sales are not re‐versioned when only
+        #      their user, course or manager changes, so their stored SKs may point at a version 2.1–2.4
+        #      just deleted; each key is therefore resolved by natural id to the ACTIVE version (a sale
+        #      whose user, course or manager no longer has one is left out). Only that delta needs a
+        #      referral, so each sale looks up its user's latest one with a LATERAL probe of
+        #      ix_user_traffic_latest instead of deduplicating all of user_traffic (the full load keeps
+        #      DISTINCT ON for that reason)
+        # ─────────────────────────────────────────────────────────────────────────────────────────
+
+        added = conn.execute(text("""
             INSERT INTO star_schema.fact_sales
               (sale_id, user_key, course_key, sales_manager_key, traffic_source_key, date_key,
                total_in_rubbles, enrollment_count)
             SELECT
               s.sale_id,
-              e.user_sk                   AS user_key,
-              e.course_sk                 AS course_key,
-              s.sales_manager_sk          AS sales_manager_key,
+              u.user_sk                   AS user_key,
+              c.course_sk                 AS course_key,
+              m.sales_manager_sk          AS sales_manager_key,
               COALESCE(ut.traffic_source_sk, -1) AS traffic_source_key,
               dd.date_key,
               s.cost_in_rubbles           AS total_in_rubbles,
@@ -1529,24 +1446,72 @@ def run_incremental_load(batch_id: int):
             JOIN warehouse.enrollments AS e 
               ON s.enrollment_sk = e.enrollment_sk
              AND e.end_date = '9999-12-31'::DATE
-            LEFT JOIN (
-              SELECT DISTINCT ON (user_sk)
-                 user_sk,
-                 traffic_source_sk,
-                 referred_at,
-                 campaign_code
-              FROM warehouse.user_traffic
-              WHERE end_date = '9999-12-31'::DATE
-              ORDER BY user_sk, referred_at DESC
-            ) AS ut
-              ON e.user_sk = ut.user_sk
+            -- the versions the enrollment/sale point at, then the active version of each natural id
+            JOIN warehouse.users AS eu
+              ON eu.user_sk = e.user_sk
+            JOIN warehouse.users AS u
+              ON u.user_id = eu.user_id
+             AND u.end_date = '9999-12-31'::DATE
+            JOIN warehouse.courses AS ec
+              ON ec.course_sk = e.course_sk
+            JOIN warehouse.courses AS c
+              ON c.course_id = ec.course_id
+             AND c.end_date = '9999-12-31'::DATE
+            JOIN warehouse.sales_managers AS sm
+              ON sm.sales_manager_sk = s.sales_manager_sk
+            JOIN warehouse.sales_managers AS m
+              ON m.manager_id = sm.manager_id
+             AND m.end_date = '9999-12-31'::DATE
+            LEFT JOIN LATERAL (
+              SELECT t.traffic_source_sk
+              FROM warehouse.user_traffic AS w
+              JOIN warehouse.traffic_sources AS wt
+                ON wt.traffic_source_sk = w.traffic_source_sk
+              JOIN warehouse.traffic_sources AS t
+                ON t.source_id = wt.source_id
+               AND t.end_date = '9999-12-31'::DATE
+              WHERE w.user_sk = u.user_sk
+                AND w.end_date = '9999-12-31'::DATE
+              ORDER BY w.referred_at DESC
+              LIMIT 1
+            ) AS ut ON TRUE
             JOIN star_schema.dim_date AS dd 
-              ON s.sale_date::DATE = dd.date
+              ON s.sale_date_d = dd.date
             WHERE s.update_id IS NULL
               AND s.end_date = '9999-12-31'::DATE
+              AND NOT EXISTS (
+                  SELECT 1
+                    FROM star_schema.fact_sales AS f
+                   WHERE f.sale_id = s.sale_id
+              )
             ON CONFLICT (sale_id) DO NOTHING;
+        """)).rowcount
+        report.append(f"   • inserted {added} star_schema.fact_sales rows (duplicates skipped)")
+
+        #  2.7) Refresh planner statistics for the star tables this batch rewrote, so BI queries (and
+        #       the next batch's own joins) are planned against the new row counts. Run on the same
+        #       connection and transaction: ANALYZE counts this transaction's own writes as live rows.
+        conn.execute(text("""
+            ANALYZE star_schema.dim_user, star_schema.dim_course, star_schema.dim_traffic_source,
+                    star_schema.dim_sales_manager, star_schema.dim_date, star_schema.fact_sales;
         """))
-    print("   • rebuilt star_schema.fact_sales (duplicates skipped)\n")
+        report.append("   • analyzed star_schema tables")
+
+        #  2.8) Re‐aggregate star_schema.fact_sales_daily in the same transaction, so it commits
+        #       together with the fact rows. CONCURRENTLY keeps it readable meanwhile but needs a
+        #       populated view; before the first full load (created WITH NO DATA) use a plain REFRESH.
+        #       A missing view (older star schema) is skipped rather than failing the batch.
+        populated = fact_sales_daily_state(conn)
+        if populated is None:
+            report.append("   • skipped star_schema.fact_sales_daily: view missing, run create_star_schema.py\n")
+        elif populated:
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY star_schema.fact_sales_daily"))
+            report.append("   • refreshed star_schema.fact_sales_daily\n")
+        else:
+            conn.execute(text("REFRESH MATERIALIZED VIEW star_schema.fact_sales_daily"))
+            report.append("   • refreshed star_schema.fact_sales_daily\n")
+    for line in report:
+        print(line)
 
     print(f"[{datetime.datetime.now(pytz.UTC)}] ✅ INCREMENTAL load complete.\n")
 